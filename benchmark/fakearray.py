@@ -0,0 +1,160 @@
+"""
+    A local stand-in for purestorage.FlashArray that generates a synthetic
+    array inventory and simulates the latency of the REST calls.
+"""
+import time
+
+
+class FakeFlashArray(object):
+    """
+    Fake FlashArray with num_volumes volumes, num_hosts hosts spread over num_hgroups host groups
+    and num_messages alert and audit messages. Every volume is privately connected to one host,
+    and every fourth volume is also shared with a host group.
+    """
+
+    def __init__(self, array_id, num_volumes=100, num_hosts=10, num_hgroups=2, num_messages=50, latency=0.0):
+        self._array_id = array_id
+        self._latency = latency
+        self._volumes = ["vol-{:05d}".format(i) for i in range(num_volumes)]
+        self._hosts = ["host-{:04d}".format(i) for i in range(num_hosts)]
+        self._hgroups = ["hgroup-{:03d}".format(i) for i in range(num_hgroups)]
+        self._num_messages = num_messages
+        self.calls = {}
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self._latency:
+            time.sleep(self._latency)
+
+    # Inventory helpers
+
+    def _host_hgroup(self, host_index):
+        return self._hgroups[host_index % len(self._hgroups)] if self._hgroups and host_index % 2 == 0 else None
+
+    def _hgroup_hosts(self, hgroup):
+        return [h for i, h in enumerate(self._hosts) if self._host_hgroup(i) == hgroup]
+
+    def _private_host(self, vol_index):
+        return self._hosts[vol_index % len(self._hosts)] if self._hosts else None
+
+    def _shared_hgroup(self, vol_index):
+        return self._hgroups[vol_index % len(self._hgroups)] if self._hgroups and vol_index % 4 == 0 else None
+
+    def _connections(self, vol_index):
+        name = self._volumes[vol_index]
+        connections = []
+        host = self._private_host(vol_index)
+        if host:
+            connections.append({"name": name, "host": host, "hgroup": None, "lun": 1, "size": 1 << 30})
+        hgroup = self._shared_hgroup(vol_index)
+        if hgroup:
+            for h in self._hgroup_hosts(hgroup):
+                connections.append({"name": name, "host": h, "hgroup": hgroup, "lun": 2, "size": 1 << 30})
+        return connections
+
+    @staticmethod
+    def _monitor(name):
+        return {"name": name, "time": "2016-01-01T00:00:00Z",
+                "reads_per_sec": 100, "writes_per_sec": 50,
+                "input_per_sec": 409600, "output_per_sec": 819200,
+                "usec_per_read_op": 250, "usec_per_write_op": 300}
+
+    @staticmethod
+    def _space(name):
+        return {"name": name, "size": 1 << 40, "total": 1 << 30, "volumes": 1 << 30, "snapshots": 0,
+                "data_reduction": 4.2, "thin_provisioning": 0.8, "total_reduction": 21.0}
+
+    def _volume_indices(self, names):
+        if names is None:
+            return range(len(self._volumes))
+        wanted = set(names.split(","))
+        return [i for i, v in enumerate(self._volumes) if v in wanted]
+
+    # purestorage.FlashArray API used by the collector
+
+    def get(self, **kwargs):
+        self._call("get")
+        if kwargs.get("action") == "monitor":
+            monitor = self._monitor(None)
+            del monitor["name"]
+            monitor["queue_depth"] = 4
+            return [monitor]
+        if kwargs.get("space"):
+            return {"hostname": "fake-{}".format(self._array_id), "capacity": 1 << 44, "total": 1 << 42,
+                    "volumes": 1 << 42, "snapshots": 0, "system": 0, "shared_space": 0,
+                    "data_reduction": 4.2, "thin_provisioning": 0.8, "total_reduction": 21.0}
+        return {"id": "fake-{}".format(self._array_id), "array_name": "fake-{}".format(self._array_id),
+                "version": "4.10.0"}
+
+    def list_messages(self, **kwargs):
+        self._call("list_messages")
+        kind = "audit" if kwargs.get("audit") else "alert"
+        return [{"id": i, "event": "{} {}".format(kind, i), "details": "", "component_name": "vol-00000",
+                 "component_type": "volume", "user": "pureuser", "category": "array",
+                 "current_severity": "info", "opened": "2016-01-01T00:00:00Z", "closed": "2016-01-01T00:01:00Z"}
+                for i in range(1, self._num_messages + 1)]
+
+    def list_volumes(self, **kwargs):
+        self._call("list_volumes")
+        indices = self._volume_indices(kwargs.get("names"))
+        if kwargs.get("action") == "monitor":
+            return [self._monitor(self._volumes[i]) for i in indices]
+        if kwargs.get("space"):
+            return [self._space(self._volumes[i]) for i in indices]
+        if kwargs.get("connect"):
+            return [c for i in indices for c in self._connections(i)]
+        return [{"name": self._volumes[i], "serial": "{}{:08X}".format(self._array_id, i), "size": 1 << 40,
+                 "created": "2016-01-01T00:00:00Z", "source": None} for i in indices]
+
+    def get_volume(self, volume, **kwargs):
+        self._call("get_volume")
+        i = self._volumes.index(volume)
+        if kwargs.get("action") == "monitor":
+            return [self._monitor(volume)]
+        if kwargs.get("space"):
+            return self._space(volume)
+        return {"name": volume, "serial": "{}{:08X}".format(self._array_id, i), "size": 1 << 40,
+                "created": "2016-01-01T00:00:00Z", "source": None}
+
+    def list_volume_private_connections(self, volume):
+        self._call("list_volume_private_connections")
+        return [c for c in self._connections(self._volumes.index(volume)) if not c["hgroup"]]
+
+    def list_volume_shared_connections(self, volume):
+        self._call("list_volume_shared_connections")
+        return [c for c in self._connections(self._volumes.index(volume)) if c["hgroup"]]
+
+    def list_hosts(self, **kwargs):
+        self._call("list_hosts")
+        if kwargs.get("space"):
+            return [dict(self._space(h), name=h) for h in self._hosts]
+        if kwargs.get("connect"):
+            return [{"name": c["host"], "vol": c["name"], "hgroup": c["hgroup"], "lun": c["lun"]}
+                    for i in range(len(self._volumes)) for c in self._connections(i)]
+        return [{"name": h, "hgroup": self._host_hgroup(i), "wwn": [], "iqn": []} for i, h in enumerate(self._hosts)]
+
+    def get_host(self, host, **kwargs):
+        self._call("get_host")
+        return dict(self._space(host), name=host)
+
+    def list_hgroups(self, **kwargs):
+        self._call("list_hgroups")
+        if kwargs.get("space"):
+            return [dict(self._space(hg), name=hg) for hg in self._hgroups]
+        if kwargs.get("connect"):
+            return [{"name": self._shared_hgroup(i), "vol": v, "lun": 2}
+                    for i, v in enumerate(self._volumes) if self._shared_hgroup(i)]
+        return [{"name": hg, "hosts": self._hgroup_hosts(hg)} for hg in self._hgroups]
+
+    def get_hgroup(self, hgroup, **kwargs):
+        self._call("get_hgroup")
+        if kwargs.get("space"):
+            return dict(self._space(hgroup), name=hgroup)
+        return {"name": hgroup, "hosts": self._hgroup_hosts(hgroup)}
+
+    def invalidate_cookie(self):
+        self._call("invalidate_cookie")
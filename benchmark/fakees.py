@@ -0,0 +1,167 @@
+"""
+    A local stand-in for the Elasticsearch HTTP endpoint. It accepts the requests
+    made by the collector, answers like a healthy cluster and records the number
+    of requests, documents and bytes it received.
+
+    The counters are read with GET /_bench/stats and cleared with POST /_bench/reset.
+
+    Usage:
+        python fakees.py --port 9250
+"""
+import argparse
+import json
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class Stats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+            self.bulk_requests = 0
+            self.documents = 0
+            self.by_endpoint = {}
+
+    def record(self, method, endpoint, size, documents=0):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.documents += documents
+            if endpoint == "_bulk":
+                self.bulk_requests += 1
+            key = "{} {}".format(method, endpoint)
+            self.by_endpoint[key] = self.by_endpoint.get(key, 0) + 1
+
+    def get_json(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "bulk_requests": self.bulk_requests,
+                "documents": self.documents,
+                "by_endpoint": dict(self.by_endpoint)
+            }
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, like a real cluster.
+    protocol_version = "HTTP/1.1"
+
+    stats = Stats()
+    indices = set()
+    indices_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status, body=None):
+        content = json.dumps(body if body is not None else {}).encode("utf-8") if self.command != "HEAD" else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
+
+    def _endpoint(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if not parts:
+            return "/", parts
+        if parts[0].startswith("_"):
+            return parts[0], parts
+        return "index" if len(parts) == 1 else parts[-1] if parts[-1].startswith("_") else "doc", parts
+
+    def _handle(self):
+        body = self._read_body()
+        endpoint, parts = self._endpoint()
+
+        if endpoint == "_bench":
+            if self.command == "POST":
+                self.stats.reset()
+                with self.indices_lock:
+                    self.indices.clear()
+            return self._reply(200, self.stats.get_json())
+
+        if endpoint == "_bulk":
+            return self._bulk(body)
+
+        self.stats.record(self.command, endpoint, len(body))
+
+        if endpoint == "/":
+            return self._reply(200, {"name": "fake", "version": {"number": "2.4.6"}})
+
+        if endpoint == "index":
+            names = parts[0].split(",")
+            with self.indices_lock:
+                if self.command == "HEAD":
+                    return self._reply(200 if all(n in self.indices for n in names) else 404)
+                if self.command == "PUT":
+                    if names[0] in self.indices:
+                        return self._reply(400, {"error": {"type": "index_already_exists_exception"}, "status": 400})
+                    self.indices.add(names[0])
+                    return self._reply(200, {"acknowledged": True})
+                if self.command == "DELETE":
+                    for n in names:
+                        self.indices.discard(n)
+                    return self._reply(200, {"acknowledged": True})
+
+        if endpoint == "_cat":
+            with self.indices_lock:
+                return self._reply(200, [{"index": n} for n in sorted(self.indices)])
+
+        return self._reply(200, {"acknowledged": True})
+
+    def _bulk(self, body):
+        lines = [l for l in body.decode("utf-8").split("\n") if l.strip()]
+        items = []
+        i = 0
+        while i < len(lines):
+            action = json.loads(lines[i])
+            op = list(action.keys())[0]
+            meta = action[op]
+            with self.indices_lock:
+                self.indices.add(meta.get("_index"))
+            items.append({op: {"_index": meta.get("_index"), "_type": meta.get("_type"), "_id": meta.get("_id"),
+                               "status": 200 if op == "delete" else 201}})
+            # All the operations but delete are followed by a source line.
+            i += 1 if op == "delete" else 2
+
+        self.stats.record(self.command, "_bulk", len(body), documents=len(items))
+        return self._reply(200, {"took": 1, "errors": False, "items": items})
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+    do_HEAD = _handle
+    do_DELETE = _handle
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeElasticsearchHandler)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a fake Elasticsearch endpoint for benchmarks.')
+    parser.add_argument('-p', '--port', type=int, default=9250, dest='port')
+    args = parser.parse_args()
+    serve(args.port)
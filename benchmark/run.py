@@ -0,0 +1,252 @@
+"""
+    Scale benchmark of the PureELK collector.
+
+    Collects from fake FlashArrays (see fakearray.py) into a fake Elasticsearch
+    endpoint (see fakees.py, started in a separate process), sweeping the number
+    of volumes per array and the number of arrays collected concurrently. For each
+    scenario it reports the cycle time, the FlashArray REST calls, the ES requests
+    and bytes and the peak memory of the collection.
+
+    Usage:
+        python benchmark/run.py
+        python benchmark/run.py --volumes 10,1000 --arrays 1,10 --latency 0.005 --target collector
+
+    --target task runs tasks.array_collect, the way the array_tasks worker does, and
+    --target collector runs PureCollector.collect() directly.
+
+    The first failure of each scenario is printed with its traceback, and the benchmark
+    exits with status 1 if any collection failed.
+"""
+from gevent import monkey
+# The array_tasks worker runs on gevent, so does the benchmark.
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import gevent.pool
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "container", "worker"))
+
+from elasticsearch import Elasticsearch
+from fakearray import FakeFlashArray
+from pureelk.arraycontext import ArrayContext
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+DEFAULT_VOLUMES = "10,100,1000,10000,50000"
+DEFAULT_ARRAYS = "1,10,50,200"
+
+
+class PeakMemory(object):
+    """
+    Peak memory allocated during a scenario. Falls back to the peak RSS of the process
+    on Python versions without tracemalloc, which never goes down between scenarios.
+    """
+
+    def __enter__(self):
+        if tracemalloc:
+            tracemalloc.start()
+        self.peak_mb = 0
+        return self
+
+    def __exit__(self, *exc):
+        if tracemalloc:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+            tracemalloc.stop()
+        else:
+            # ru_maxrss is in KB on Linux
+            self.peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class FakeEndpoint(object):
+    """
+    The fake ES endpoint running in a child process, so its CPU time doesn't count in the cycle time.
+    """
+
+    def __init__(self, port):
+        self.hosts = "127.0.0.1:{}".format(port)
+        self._process = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, "fakees.py"), "--port", str(port)])
+        self._client = Elasticsearch(hosts=self.hosts)
+        for _ in range(50):
+            try:
+                self._client.info()
+                return
+            except Exception:
+                time.sleep(0.1)
+        raise RuntimeError("Fake Elasticsearch endpoint didn't start on {}".format(self.hosts))
+
+    def reset(self):
+        self._client.transport.perform_request("POST", "/_bench/reset")
+
+    def stats(self):
+        return self._client.transport.perform_request("GET", "/_bench/stats")
+
+    def stop(self):
+        self._process.terminate()
+        self._process.wait()
+
+
+def make_array_context(i, args):
+    array = ArrayContext()
+    array.update_config_json({
+        ArrayContext.ID: "fake-{:04d}".format(i),
+        ArrayContext.NAME: "fake-{:04d}".format(i),
+        ArrayContext.HOST: "fake-{:04d}.example.com".format(i),
+        ArrayContext.API_TOKEN: "token",
+        ArrayContext.COLLECTION_MODE: args.mode
+    })
+    return array
+
+
+def collector_runner(es_hosts, args):
+    """
+    :return: function collecting one array with PureCollector.collect()
+    """
+    from pureelk.bulkindexer import BulkIndexer
+    from pureelk.indexcache import IndexCache
+    from pureelk.purecollector import PureCollector
+
+    es_client = Elasticsearch(hosts=es_hosts, retry_on_timeout=True, maxsize=args.concurrency)
+    index_cache = IndexCache()
+
+    def run(array_context, ps_client):
+        PureCollector(ps_client, es_client, BulkIndexer(es_client), index_cache, array_context).collect()
+
+    return run
+
+
+def task_runner(es_hosts, args, config_dir):
+    """
+    :return: function collecting one array with tasks.array_collect, as the array_tasks worker does.
+    """
+    from pureelk import worker
+    from pureelk.context import Context
+    # The worker normally gets its context from the --array-configs command line option.
+    worker.context = Context(config_dir)
+    from pureelk import tasks
+
+    tasks.ES_HOSTS = es_hosts
+    fake_arrays = {}
+    tasks.client_pool.get_flasharray = lambda array_context: fake_arrays[array_context.id]
+
+    def run(array_context, ps_client):
+        fake_arrays[array_context.id] = ps_client
+        tasks.array_collect(array_context, deadline=time.time())
+
+    return run
+
+
+def run_scenario(runner, endpoint, num_arrays, num_volumes, args):
+    arrays = [(make_array_context(i, args), FakeFlashArray(
+        "{:04d}".format(i),
+        num_volumes=num_volumes,
+        num_hosts=max(1, num_volumes // 10),
+        num_hgroups=max(1, num_volumes // 100),
+        num_messages=args.messages,
+        latency=args.latency)) for i in range(num_arrays)]
+
+    endpoint.reset()
+    errors = []
+
+    def collect(array):
+        try:
+            runner(*array)
+        except Exception:
+            # Only the first traceback is printed, the others are likely the same.
+            if not errors:
+                sys.stderr.write("Collection of array '{}' failed:\n{}".format(array[0].name, traceback.format_exc()))
+            errors.append(sys.exc_info()[1])
+
+    with PeakMemory() as memory:
+        start = time.time()
+        # Like the gevent pool of the array_tasks worker.
+        pool = gevent.pool.Pool(args.concurrency)
+        pool.map(collect, arrays)
+        elapsed = time.time() - start
+
+    stats = endpoint.stats()
+    return {
+        "arrays": num_arrays,
+        "volumes": num_volumes,
+        "cycle_secs": elapsed,
+        "rest_calls": sum(fa.call_count for _, fa in arrays),
+        "es_requests": stats["requests"],
+        "es_bulk_requests": stats["bulk_requests"],
+        "es_documents": stats["documents"],
+        "es_mb": stats["bytes"] / 1024.0 / 1024.0,
+        "peak_mb": memory.peak_mb,
+        "errors": len(errors)
+    }
+
+
+def print_result(result):
+    print("{arrays:>6} {volumes:>8} {cycle_secs:>10.2f} {rest_calls:>10} {es_requests:>8} {es_bulk_requests:>6} "
+          "{es_documents:>10} {es_mb:>9.1f} {peak_mb:>9.1f} {errors:>6}".format(**result))
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scale benchmark of the PureELK collector.')
+    parser.add_argument('--volumes', default=DEFAULT_VOLUMES,
+                        help="Comma separated volume counts per array, swept with a single array.")
+    parser.add_argument('--arrays', default=DEFAULT_ARRAYS,
+                        help="Comma separated array counts, swept with --array-volumes volumes each.")
+    parser.add_argument('--array-volumes', type=int, default=100, dest='array_volumes')
+    parser.add_argument('--messages', type=int, default=50, help="Alert and audit messages per array.")
+    parser.add_argument('--latency', type=float, default=0.002, help="Latency of each REST call, in seconds.")
+    parser.add_argument('--mode', default=ArrayContext.COLLECTION_MODE_BATCH,
+                        choices=[ArrayContext.COLLECTION_MODE_BATCH, ArrayContext.COLLECTION_MODE_PER_VOLUME])
+    parser.add_argument('--concurrency', type=int, default=1000,
+                        help="Size of the gevent pool running the collections, as in the array_tasks worker.")
+    parser.add_argument('--target', default="task", choices=["task", "collector"])
+    parser.add_argument('--port', type=int, default=9250, help="Port of the fake Elasticsearch endpoint.")
+    parser.add_argument('--json', dest='json_output', help="Also write the results to this file as json.")
+    args = parser.parse_args()
+
+    endpoint = FakeEndpoint(args.port)
+    config_dir = tempfile.mkdtemp(prefix="pureelk-bench-")
+    results = []
+
+    try:
+        if args.target == "task":
+            runner = task_runner(endpoint.hosts, args, config_dir)
+        else:
+            runner = collector_runner(endpoint.hosts, args)
+
+        print("{:>6} {:>8} {:>10} {:>10} {:>8} {:>6} {:>10} {:>9} {:>9} {:>6}".format(
+            "arrays", "volumes", "cycle(s)", "rest", "es_req", "bulk", "docs", "es(MB)", "peak(MB)", "errors"))
+
+        scenarios = [(1, int(v)) for v in args.volumes.split(",") if v] + \
+                    [(int(a), args.array_volumes) for a in args.arrays.split(",") if a]
+        for num_arrays, num_volumes in scenarios:
+            result = run_scenario(runner, endpoint, num_arrays, num_volumes, args)
+            results.append(result)
+            print_result(result)
+    finally:
+        endpoint.stop()
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+    if args.json_output:
+        with open(args.json_output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    # The timings of failed collections are meaningless.
+    if any(result["errors"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
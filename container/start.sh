@@ -14,11 +14,32 @@ export C_FORCE_ROOT=1
 
 CONF_DIR=/pureelk/worker/conf
 
-# Start the celery scheduling worker. It sends the actual task out.
-celery -A pureelk.worker worker --loglevel=info --beat --config workerconfig --workdir worker/ --logfile /var/log/pureelk/scheduler.log --array-configs $CONF_DIR -c 1 &
+# Start the workers of a node. Without a node id, they are the only ones.
+start_node() {
+    local NODE_OPTS=""
+    local SUFFIX=""
+    if [ -n "$1" ]; then
+        NODE_OPTS="--node-id $1"
+        SUFFIX="-$1"
+    fi
 
-# Start the array collection tasks on array_tasks queue, using gevent concurrency mode since it is I/O intensive
-celery -A pureelk.worker worker --loglevel=info --config workerconfig --workdir worker/ --logfile /var/log/pureelk/array-tasks.log -P gevent -Q array_tasks  &
+    # Start the celery scheduling worker. It sends the actual task out.
+    celery -A pureelk.worker worker --loglevel=info --beat --config workerconfig --workdir worker/ --logfile /var/log/pureelk/scheduler$SUFFIX.log --array-configs $CONF_DIR -c 1 -n scheduler$SUFFIX@%h -s celerybeat-schedule$SUFFIX $NODE_OPTS &
+
+    # Start the array collection tasks on array_tasks queue, using gevent concurrency mode since it is I/O intensive
+    celery -A pureelk.worker worker --loglevel=info --config workerconfig --workdir worker/ --logfile /var/log/pureelk/array-tasks$SUFFIX.log --array-configs $CONF_DIR -P gevent -Q array_tasks -n array-tasks$SUFFIX@%h  &
+}
+
+# Set PUREELK_NODES to run several worker nodes, sharing the arrays by a consistent hash of their ids.
+# Nodes in other containers share them too if they use the same config folder and PUREELK_BROKER_URL,
+# with a different PUREELK_NODE_PREFIX.
+if [ -z "$PUREELK_NODES" ]; then
+    start_node ""
+else
+    for i in $(seq 1 $PUREELK_NODES); do
+        start_node "${PUREELK_NODE_PREFIX:-$(hostname)}-$i"
+    done
+fi
 
 # Export the python modules from worker and web folder
 export PYTHONPATH=$PYTHONPATH:/pureelk/web/:/pureelk/worker/
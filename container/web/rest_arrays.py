@@ -1,5 +1,7 @@
 
 import flask
+import hashlib
+import json
 import purestorage
 
 from flask import current_app
@@ -10,23 +12,76 @@ from errorcodes import ErrorCodes
 
 
 ARRAY_CONFIGS = "array-configs"
+STATS_LISTENER = "stats-listener"
 USERNAME = "username"
 PASSWORD = "password"
 HOST = "host"
 
 arrays = flask.Blueprint('arrays', __name__)
 
+# The store of each config path lives as long as the web process, so that it only re-reads
+# the files that changed. Along with it, the last array list served and its signature.
+stores = {}
+arrays_cache = {}
+
 
 @arrays.route("/", methods=["GET"])
 @rest_api
 def get_arrays():
     """
-    Gets all the arrays
+    Gets all the arrays. The UI polls it, so the list is only rebuilt when the configs or the state
+    change on disk, and it is tagged with an ETag so that unchanged lists get a 304.
     :return: List of arrays in the system
     """
-    store = Store(array_config_path(), current_app.logger)
-    array_dict = store.load_arrays()
-    return [a.get_json() for a in array_dict.values()]
+    store = get_store()
+    signature = store.signature()
+
+    cached = arrays_cache.get(array_config_path())
+    if cached is None or cached[0] != signature:
+        body = json.dumps([a.get_json() for a in store.load_arrays().values()])
+        cached = (signature, body, hashlib.md5(body.encode("utf-8")).hexdigest())
+        arrays_cache[array_config_path()] = cached
+
+    response = flask.Response(cached[1], content_type='application/json; charset=utf-8')
+    response.set_etag(cached[2])
+    # Let the browsers keep the list, but check with us every time.
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(flask.request)
+
+
+@arrays.route("/stats", methods=["GET"])
+@rest_api
+def get_fleet_stats():
+    """
+    Gets the latest collection stats of all the arrays, and the number of collections waiting to run.
+    :return: The stats of the fleet.
+    """
+    listener = current_app.config.get(STATS_LISTENER)
+    return {
+        "array_tasks_queue_depth": listener.queue_depth if listener else None,
+        "arrays": [array_stats(a, listener) for a in get_store().load_arrays().values()]
+    }
+
+
+@arrays.route("/<array_id>/stats", methods=["GET"])
+@rest_api
+def get_array_stats(array_id):
+    """
+    Gets the latest collection stats of an array: cycle duration and per-section timings, documents
+    indexed, REST errors and scheduling lag.
+    :param array_id: The array id.
+    :return: The stats of the array, null stats if no collection was reported since the web server started.
+    """
+    array_dict = get_store().load_arrays()
+    if array_id not in array_dict:
+        return make_rest_response(
+            make_error(ErrorCodes.ArrayNotFound.value, "Array not found with id {}".format(array_id)),
+            404)
+
+    listener = current_app.config.get(STATS_LISTENER)
+    result = array_stats(array_dict[array_id], listener)
+    result["array_tasks_queue_depth"] = listener.queue_depth if listener else None
+    return result
 
 
 @arrays.route("/", methods=["POST"])
@@ -38,7 +93,7 @@ def add_array(json_body=None):
     The array object added, which contains the array_id which could be used later
     to delete this array.
     """
-    error_data = validate_array_input(json_body)
+    error_data = validate_array_input(json_body) or validate_frequencies(json_body)
     if error_data:
         return make_rest_response(error_data, 400)
 
@@ -57,7 +112,7 @@ def add_array(json_body=None):
         ArrayContext.PURITY_VERSION: purity_version
     })
 
-    store = Store(array_config_path(), current_app.logger)
+    store = get_store()
 
     existing_arrays = store.load_arrays()
 
@@ -89,7 +144,11 @@ def update_array(array_id, json_body=None):
     if ArrayContext.ID in json_body:
         del json_body[ArrayContext.ID]
 
-    store = Store(array_config_path(), current_app.logger)
+    error_data = validate_frequencies(json_body)
+    if error_data:
+        return make_rest_response(error_data, 400)
+
+    store = get_store()
     array_dict = store.load_arrays()
 
     if array_id not in array_dict:
@@ -137,7 +196,7 @@ def delete_array(array_id):
     :param array_id:
     :return:
     """
-    store = Store(array_config_path(), current_app.logger)
+    store = get_store()
 
     arrays = store.load_arrays()
 
@@ -172,10 +231,56 @@ def validate_array_input(input_json):
     return None
 
 
+def validate_frequencies(input_json):
+    """
+    The per-section frequencies are optional, e.g. {"monitor": 30, "space": 300, "inventory": 1800}.
+    """
+    frequencies = input_json.get(ArrayContext.FREQUENCIES)
+    if frequencies is None:
+        return None
+
+    if not isinstance(frequencies, dict):
+        return make_error(ErrorCodes.InvalidInput.value, "'{}' must be an object.".format(ArrayContext.FREQUENCIES))
+
+    for section, frequency in frequencies.items():
+        if section not in ArrayContext.SECTIONS:
+            return make_error(ErrorCodes.InvalidInput.value, "Unknown section '{}' in '{}', expected one of {}.".format(
+                section, ArrayContext.FREQUENCIES, ", ".join(ArrayContext.SECTIONS)))
+        try:
+            valid = int(frequency) > 0
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            return make_error(ErrorCodes.InvalidInput.value,
+                              "The frequency of '{}' must be a positive number of seconds.".format(section))
+
+    return None
+
+
 def array_config_path():
     return current_app.config[ARRAY_CONFIGS]
 
 
+def array_stats(array, listener):
+    stats = listener.get(array.id) if listener else None
+    return {
+        ArrayContext.ID: array.id,
+        ArrayContext.NAME: array.name,
+        ArrayContext.FREQUENCY: array.frequency,
+        ArrayContext.FREQUENCIES: array.frequencies,
+        # How much of the collection interval the last cycle used, close to 1 means it can't keep up.
+        "frequency_budget_used": stats["total_secs"] / array.frequency if stats else None,
+        "stats": stats
+    }
+
+
+def get_store():
+    path = array_config_path()
+    if path not in stores:
+        stores[path] = Store(path, current_app.logger)
+    return stores[path]
+
+
 def get_array_info(host, username, password):
     ps_client = purestorage.FlashArray(host, username, password)
     array_obj = ps_client.get()
@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+from collections import namedtuple
+
+from flask import Response, abort
+
+try:
+    import brotli
+except ImportError:
+    # Installed by the Dockerfile. Without it, e.g. when run outside of the container, only gzip is served.
+    brotli = None
+
+# Font types missing from the mimetypes database of older Pythons.
+mimetypes.add_type("application/font-woff", ".woff")
+mimetypes.add_type("font/woff2", ".woff2")
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+
+Asset = namedtuple("Asset", ["mimetype", "etag", "variants"])
+
+
+class StaticAssets(object):
+    """
+    In-memory copy of the static files, loaded once at startup along with their gzip and brotli
+    variants and a strong ETag. Each request is served the smallest variant the client accepts.
+    """
+    # A compressed variant is only kept if it is smaller than this fraction of the file,
+    # e.g. images and woff fonts are already compressed.
+    MIN_RATIO = 0.9
+
+    # Cache-Control of the files that never change between releases, and of the others.
+    LONG_CACHE_CONTROL = "public, max-age=31536000"
+    DEFAULT_CACHE_CONTROL = "no-cache"
+
+    def __init__(self, folder, long_cache_prefixes=()):
+        """
+        :param folder: The folder of the static files.
+        :param long_cache_prefixes: Path prefixes of the files cached for a long time by the browsers,
+                                    e.g. the vendor libraries.
+        """
+        self._long_cache_prefixes = tuple(long_cache_prefixes)
+        self._assets = {}
+
+        for root, dirs, files in os.walk(folder):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, folder).replace(os.sep, "/")
+                self._assets[name] = self._load(path)
+
+    @classmethod
+    def _load(cls, path):
+        with open(path, "rb") as asset_file:
+            data = asset_file.read()
+
+        variants = {IDENTITY: data}
+        compressors = [(GZIP, _gzip)] + ([(BROTLI, brotli.compress)] if brotli else [])
+        for encoding, compress in compressors:
+            compressed = compress(data)
+            if len(compressed) < len(data) * cls.MIN_RATIO:
+                variants[encoding] = compressed
+
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return Asset(mimetype, hashlib.md5(data).hexdigest(), variants)
+
+    def response(self, name, request):
+        """
+        :param name: The path of the file relative to the static folder.
+        :param request: The request, for content negotiation and conditional responses.
+        :return: The response serving the file, 304 if the client has it already.
+        """
+        asset = self._assets.get(name)
+        if asset is None:
+            abort(404)
+
+        encoding = IDENTITY
+        for candidate in [BROTLI, GZIP]:
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        response.headers["Vary"] = "Accept-Encoding"
+        if encoding != IDENTITY:
+            response.headers["Content-Encoding"] = encoding
+
+        # Each variant is a different representation, so it needs its own strong ETag.
+        response.set_etag(asset.etag if encoding == IDENTITY else "{}-{}".format(asset.etag, encoding))
+        response.headers["Cache-Control"] = self.LONG_CACHE_CONTROL \
+            if name.startswith(self._long_cache_prefixes) \
+            else self.DEFAULT_CACHE_CONTROL
+
+        return response.make_conditional(request)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    # A fixed mtime, so the same file always compresses to the same bytes.
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
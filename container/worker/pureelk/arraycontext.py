@@ -1,3 +1,5 @@
+import time
+
 
 class ArrayContext(object):
     """
@@ -15,19 +17,70 @@ class ArrayContext(object):
     FREQUENCY = "frequency" # In seconds
     ENABLED = "enabled"
     DATA_TTL = "data_ttl"   # This follows the elastic search spec, e.g. "90d" is 90 days.
+    COLLECTION_MODE = "collection_mode"
+    COLLECT_CONCURRENCY = "collect_concurrency"  # Max number of sections of an array collected at the same time
+    FANOUT_VOLUMES = "fanout_volumes"  # Arrays with more volumes have them collected by parallel chunk tasks
+    FANOUT_CHUNK_SIZE = "fanout_chunk_size"  # Number of volumes collected by each chunk task
+    VOLUME_PAGE_SIZE = "volume_page_size"  # Number of volumes or hosts fetched and indexed at a time
+    FREQUENCIES = "frequencies"  # In seconds, e.g. {"monitor": 30, "space": 300, "inventory": 1800}
+    COLLECT_TIME_LIMIT = "collect_time_limit"  # In seconds. A collection or chunk task running longer fails
+
+    # Sections of the collected data with their own frequencies. "monitor" is the performance counters
+    # and the messages, collected on every cycle. "space" is the space usage of the array, volumes, hosts
+    # and host groups. "inventory" is the list of volumes with their serials, hosts, host groups and connections.
+    # Between two refreshes of a section, the collections reuse its last data.
+    SECTION_MONITOR = "monitor"
+    SECTION_SPACE = "space"
+    SECTION_INVENTORY = "inventory"
+    SECTIONS = (SECTION_MONITOR, SECTION_SPACE, SECTION_INVENTORY)
+
+    # Collection modes. In "batch" mode each volume dataset is fetched once for the whole array,
+    # in "per_volume" mode the datasets are fetched with separate REST calls for each volume.
+    COLLECTION_MODE_BATCH = "batch"
+    COLLECTION_MODE_PER_VOLUME = "per_volume"
 
     # Execution values coming from job processing
     TASK_TIMESTAMP = "task_timestamp"
     TASK_STATE = "task_state"
 
+    # States of a collection task, reported by the task events.
+    TASK_PENDING = "PENDING"
+    TASK_STARTED = "STARTED"
+    TASK_SUCCESS = "SUCCESS"
+    TASK_FAILURE = "FAILURE"
+    TASK_REVOKED = "REVOKED"
+    TASK_COMPLETED_STATES = (TASK_SUCCESS, TASK_FAILURE, TASK_REVOKED)
+
+    # In seconds. A task not started this long after its deadline expires, and is revoked.
+    TASK_START_TIMEOUT = 300
+
+    # In seconds. Large arrays and fanned out collections can take long, but a collection task still
+    # running after its time limit is stopped and fails.
+    DEFAULT_COLLECT_TIME_LIMIT = 1800
+
+    # In seconds. Added to the longest a task can take, before it is considered lost.
+    TASK_LOST_MARGIN = 60
+
     # Default polling frequency is 60 sec
     DEFAULT_FREQUENCY = 60
 
+    # By default all the sections of a collection, the topology included, are collected concurrently
+    DEFAULT_COLLECT_CONCURRENCY = None
+
+    DEFAULT_FANOUT_CHUNK_SIZE = 5000
+
+    # Pages are selected by volume names, this many names keep the REST URLs reasonably short.
+    DEFAULT_VOLUME_PAGE_SIZE = 500
+
     def __init__(self):
         self._config_json = {}
-        self._task = None
+        self._task_id = None
         self._task_starttime = 0
         self._task_state = None
+        self._chunks_pending = 0
+        self._chunks_failed = False
+        self._deferred_state = None
+        self._scheduler_queue = None
 
     @property
     def id(self):
@@ -75,29 +128,100 @@ class ArrayContext(object):
         # Default to None, i.e. no data retention.
         return self._config_json[ArrayContext.DATA_TTL] if ArrayContext.DATA_TTL in self._config_json else None
 
+    @property
+    def collection_mode(self):
+        return self._config_json[ArrayContext.COLLECTION_MODE] \
+            if ArrayContext.COLLECTION_MODE in self._config_json \
+            else ArrayContext.COLLECTION_MODE_BATCH
+
+    @property
+    def collect_concurrency(self):
+        # None for as many as the collection has sections
+        return max(1, int(self._config_json[ArrayContext.COLLECT_CONCURRENCY])) \
+            if ArrayContext.COLLECT_CONCURRENCY in self._config_json \
+            else ArrayContext.DEFAULT_COLLECT_CONCURRENCY
+
+    @property
+    def fanout_volumes(self):
+        # Default to None, i.e. the volumes are always collected by the array's own task.
+        return int(self._config_json[ArrayContext.FANOUT_VOLUMES]) \
+            if self._config_json.get(ArrayContext.FANOUT_VOLUMES) \
+            else None
+
+    @property
+    def fanout_chunk_size(self):
+        return max(1, int(self._config_json[ArrayContext.FANOUT_CHUNK_SIZE])) \
+            if ArrayContext.FANOUT_CHUNK_SIZE in self._config_json \
+            else ArrayContext.DEFAULT_FANOUT_CHUNK_SIZE
+
+    @property
+    def volume_page_size(self):
+        return max(1, int(self._config_json[ArrayContext.VOLUME_PAGE_SIZE])) \
+            if ArrayContext.VOLUME_PAGE_SIZE in self._config_json \
+            else ArrayContext.DEFAULT_VOLUME_PAGE_SIZE
+
+    @property
+    def collect_time_limit(self):
+        return max(1, int(self._config_json[ArrayContext.COLLECT_TIME_LIMIT])) \
+            if ArrayContext.COLLECT_TIME_LIMIT in self._config_json \
+            else ArrayContext.DEFAULT_COLLECT_TIME_LIMIT
+
+    @property
+    def task_lost_timeout(self):
+        """
+        Seconds after its start time a collection is considered lost, e.g. because the worker running it died
+        without sending its completion event. A collection can't be running any more by then: its task must start
+        within the start timeout, and is stopped at its time limit. So are the chunk tasks of a fanned out collection,
+        sent by the collection task before it completes.
+        """
+        timeout = ArrayContext.TASK_START_TIMEOUT + self.collect_time_limit
+        if self.fanout_volumes:
+            timeout *= 2
+        return timeout + ArrayContext.TASK_LOST_MARGIN
+
     @property
     def frequency(self):
+        # The period of the collections, i.e. the frequency of the monitor section.
+        return self.section_frequency(ArrayContext.SECTION_MONITOR)
+
+    @property
+    def frequencies(self):
+        return dict((section, self.section_frequency(section)) for section in ArrayContext.SECTIONS)
+
+    def section_frequency(self, section):
+        """
+        :param section: One of ArrayContext.SECTIONS.
+        :return: The frequency of the section in seconds. Without their own frequency, the sections are
+                 collected on every cycle.
+        """
+        frequencies = self._config_json.get(ArrayContext.FREQUENCIES) or {}
+        if frequencies.get(section):
+            return max(1, int(frequencies[section]))
+        if section != ArrayContext.SECTION_MONITOR:
+            return self.frequency
         return int(self._config_json[ArrayContext.FREQUENCY]) \
             if ArrayContext.FREQUENCY in self._config_json \
             else ArrayContext.DEFAULT_FREQUENCY
 
     @property
-    def task(self):
-        return self._task
+    def task_id(self):
+        return self._task_id
 
-    @task.setter
-    def task(self, value):
-        self._task = value
+    @task_id.setter
+    def task_id(self, value):
+        self._task_id = value
+        # A new task hasn't fanned out any volume chunks yet.
+        self._chunks_pending = 0
+        self._chunks_failed = False
+        self._deferred_state = None
 
     @property
     def task_state(self):
-        # If there is a task object, we get the latest state from the task.
-        # otherwise, we get the cached state retrieved from deserialization.
-        return self.task.state if self.task is not None else self._task_state
+        # The state is kept up to date in memory by the task events sent from the collection worker.
+        return self._task_state
 
     @task_state.setter
     def task_state(self, value):
-        # Use when deserializing the state from file
         self._task_state = value
 
     @property
@@ -108,9 +232,49 @@ class ArrayContext(object):
     def task_starttime(self, value):
         self._task_starttime = value
 
+    @property
+    def chunks_pending(self):
+        # Number of volume chunk tasks of the current task that haven't completed yet.
+        return self._chunks_pending
+
+    @chunks_pending.setter
+    def chunks_pending(self, value):
+        self._chunks_pending = value
+
+    @property
+    def chunks_failed(self):
+        return self._chunks_failed
+
+    @chunks_failed.setter
+    def chunks_failed(self, value):
+        self._chunks_failed = value
+
+    @property
+    def deferred_state(self):
+        # Completion state reported by the task itself while some of its chunks are still pending.
+        return self._deferred_state
+
+    @deferred_state.setter
+    def deferred_state(self, value):
+        self._deferred_state = value
+
+    @property
+    def scheduler_queue(self):
+        # Queue of the scheduling worker that dispatched the collection, for its task events.
+        # None for the default queue of a single node.
+        return self._scheduler_queue
+
+    @scheduler_queue.setter
+    def scheduler_queue(self, value):
+        self._scheduler_queue = value
+
     @property
     def is_task_completed(self):
-        return self.task is None or self.task.state == "FAILURE" or self.task.state == "SUCCESS"
+        # A task that hasn't reported its completion long after its start time is considered lost,
+        # e.g. the worker running it died.
+        return self.task_id is None or \
+            self.task_state in ArrayContext.TASK_COMPLETED_STATES or \
+            time.time() > self.task_starttime + self.task_lost_timeout
 
     def get_config_json(self):
         """
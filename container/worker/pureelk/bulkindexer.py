@@ -0,0 +1,198 @@
+import json
+import time
+
+from celery.utils.log import get_task_logger
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+logger = get_task_logger(__name__)
+
+# Per-item statuses returned by _bulk that are worth another attempt, e.g. a full
+# bulk thread pool queue (429) or a shard that is temporarily unavailable (503).
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def is_retryable(error):
+    """
+    Whether a failed request is worth sending again later, i.e. Elasticsearch is unreachable or busy.
+    ConnectionError (incl. timeouts) is a TransportError without an HTTP status.
+    """
+    return isinstance(error, ConnectionError) or error.status_code in RETRY_STATUSES
+
+
+class BulkIndexer(object):
+    """
+    Buffers index actions and sends them to Elasticsearch through the _bulk API.
+    A batch is flushed when it reaches either the action count or the byte limit.
+    Items rejected with a retryable status are resent with exponential backoff,
+    the others are logged and counted as failed.
+    With a spool, batches that can't be sent because Elasticsearch is unavailable,
+    or while earlier batches are still waiting in the spool, are spooled on disk
+    instead, to be replayed later by the spool drainer.
+    """
+    DEFAULT_CHUNK_SIZE = 500
+    DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_RETRY_BACKOFF = 1  # In seconds, doubled on every retry
+
+    def __init__(self, es_client,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 metrics=None,
+                 spool=None):
+        self._es_client = es_client
+        self._metrics = metrics
+        self._spool = spool
+        self._chunk_size = chunk_size
+        self._max_chunk_bytes = max_chunk_bytes
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+
+        # Pending actions as (action line, source line) pairs and their size in bytes.
+        self._actions = []
+        self._size = 0
+
+        self._indexed = 0
+        self._failed = 0
+        self._spooled = 0
+
+    @property
+    def indexed(self):
+        return self._indexed
+
+    @property
+    def failed(self):
+        return self._failed
+
+    @property
+    def spooling(self):
+        return self._spool is not None
+
+    @property
+    def spooled(self):
+        return self._spooled
+
+    def index(self, index, doc_type, body, id=None):
+        """
+        Queue a document for indexing.
+        :param index: The target index.
+        :param doc_type: The document type.
+        :param body: The document, either a dict or an already serialized json string.
+        :param id: Optional document id, so that ES versioning replaces the previous document.
+        """
+        meta = {"_index": index, "_type": doc_type}
+        if id is not None:
+            meta["_id"] = id
+
+        self.index_action((json.dumps({"index": meta}), body if not isinstance(body, dict) else json.dumps(body)))
+
+    def index_action(self, action):
+        """
+        Queue an already serialized action.
+        :param action: tuple of (action line, source line).
+        """
+        if self._metrics is not None:
+            self._metrics.record_document()
+        action_size = len(action[0]) + len(action[1]) + 2
+
+        # Flush first if this document would push the batch over the byte limit.
+        if self._actions and self._size + action_size > self._max_chunk_bytes:
+            self.flush()
+
+        self._actions.append(action)
+        self._size += action_size
+
+        if len(self._actions) >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Send all the pending actions to Elasticsearch.
+        """
+        # Swap the buffer out before any I/O so that documents queued meanwhile go to the next batch.
+        actions, self._actions = self._actions, []
+        self._size = 0
+
+        # Earlier batches are still waiting to be replayed, keep the order and don't add to the load.
+        if actions and self._spool is not None and self._spool.pending:
+            self._spool_actions(actions)
+            return
+
+        attempt = 0
+        while actions:
+            try:
+                failures = self._send(actions)
+            except TransportError as e:
+                if self._spool is None or not is_retryable(e):
+                    raise
+                logger.warn("Elasticsearch is unavailable, spooling {} documents".format(len(actions)))
+                self._spool_actions(actions)
+                return
+
+            self._indexed += len(actions) - len(failures)
+
+            retries = []
+            exhausted = []
+            for action, status, error in failures:
+                if status in RETRY_STATUSES and attempt < self._max_retries:
+                    retries.append(action)
+                elif status in RETRY_STATUSES and self._spool is not None:
+                    exhausted.append(action)
+                else:
+                    self._failed += 1
+                    logger.error("Failed to index document {}: status = {}, error = {}".format(
+                        action[0], status, error))
+
+            if exhausted:
+                self._spool_actions(exhausted)
+
+            if retries:
+                logger.warn("Retrying {} rejected documents, attempt {}".format(len(retries), attempt + 1))
+                time.sleep(self._retry_backoff * 2 ** attempt)
+                attempt += 1
+
+            actions = retries
+
+    def _send(self, actions):
+        """
+        Send one _bulk request. The whole request is retried on connection errors
+        and retryable HTTP statuses.
+        :return: list of (action, status, error) for the items that were not indexed.
+        """
+        body = "\n".join(line for action in actions for line in action) + "\n"
+
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = self._es_client.bulk(body=body)
+                break
+            except TransportError as e:
+                self._record_request(body, start)
+                if not is_retryable(e) or attempt >= self._max_retries:
+                    raise
+                logger.warn("Bulk request of {} documents failed, attempt {}: {}".format(len(actions), attempt + 1, e))
+                time.sleep(self._retry_backoff * 2 ** attempt)
+                attempt += 1
+
+        self._record_request(body, start)
+        if not response.get("errors"):
+            return []
+
+        failures = []
+        for action, item in zip(actions, response["items"]):
+            result = list(item.values())[0]
+            status = result.get("status", 500)
+            if status >= 300:
+                failures.append((action, status, result.get("error")))
+
+        return failures
+
+    def _spool_actions(self, actions):
+        self._spool.append(actions)
+        self._spooled += len(actions)
+
+    def _record_request(self, body, start):
+        if self._metrics is not None:
+            self._metrics.record_es_request(len(body), time.time() - start)
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import time
+
+# Fields that change on every collection and don't count as a change of a global document:
+# the time of the sample, the performance counters and the space usage.
+VOLATILE_FIELDS = frozenset([
+    "timeofquery",
+    "time",
+    "reads_per_sec",
+    "writes_per_sec",
+    "input_per_sec",
+    "output_per_sec",
+    "usec_per_read_op",
+    "usec_per_write_op",
+    "san_usec_per_read_op",
+    "san_usec_per_write_op",
+    "local_queue_usec_per_op",
+    "queue_depth",
+    "total",
+    "volumes",
+    "snapshots",
+    "shared_space",
+    "system",
+    "data_reduction",
+    "thin_provisioning",
+    "total_reduction"
+])
+
+
+def content_hash(doc):
+    """
+    Hash of the fields of a document that are not volatile.
+    """
+    relevant = dict((k, v) for k, v in doc.items() if k not in VOLATILE_FIELDS)
+    return hashlib.md5(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ChangeCache(object):
+    """
+    Per-array cache of the content hashes of the global documents last written, so that
+    the documents whose relevant fields didn't change are not reindexed every cycle,
+    which would create a new version and a delete tombstone in ES each time.
+    Unchanged documents are still rewritten once every refresh interval.
+    """
+    DEFAULT_REFRESH_INTERVAL = 3600  # In seconds
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self._refresh_interval = refresh_interval
+        # array id -> {(index, doc id): (content hash, time written)}
+        self._arrays = {}
+
+    def should_write(self, array_id, index, doc_id, doc):
+        """
+        Whether a global document must be written, and if so remember it as written.
+        """
+        now = time.time()
+        digest = content_hash(doc)
+        entries = self._arrays.setdefault(array_id, {})
+        entry = entries.get((index, doc_id))
+
+        if entry is not None and entry[0] == digest and now - entry[1] < self._refresh_interval:
+            return False
+
+        entries[(index, doc_id)] = (digest, now)
+        return True
+
+    def prune(self, array_id, index, doc_ids):
+        """
+        Forget the documents of an index that are no longer collected, e.g. deleted volumes.
+        :param doc_ids: The ids of the documents still collected.
+        """
+        entries = self._arrays.get(array_id, {})
+        keep = set(doc_ids)
+        for key in [k for k in entries if k[0] == index and k[1] not in keep]:
+            del entries[key]
+
+    def invalidate(self, array_id):
+        """
+        Forget all the documents of an array, so they are all written on the next collection.
+        """
+        self._arrays.pop(array_id, None)
@@ -0,0 +1,81 @@
+import time
+
+import purestorage
+from celery.utils.log import get_task_logger
+from elasticsearch import Elasticsearch
+
+logger = get_task_logger(__name__)
+
+
+class ClientPool(object):
+    """
+    Keeps the authenticated FlashArray REST sessions and the Elasticsearch
+    clients of a worker process alive between collections, so that each
+    collection doesn't pay for a new login handshake and TLS connection.
+    The collection workers are not told about the arrays removed from the config, or moved
+    to another node. Their sessions are closed once they were not used for idle_timeout.
+    """
+    REST_VERSION = "1.4"
+    DEFAULT_ES_MAXSIZE = 25  # Keep-alive connections per ES host
+    DEFAULT_IDLE_TIMEOUT = 3600  # In seconds
+
+    def __init__(self, es_maxsize=DEFAULT_ES_MAXSIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._es_maxsize = es_maxsize
+        self._idle_timeout = idle_timeout
+        # array id -> (host, api token, FlashArray session, time of last use)
+        self._flasharrays = {}
+        # ES hosts -> Elasticsearch client
+        self._es_clients = {}
+
+    def get_flasharray(self, array_context):
+        """
+        Get the pooled FlashArray client of an array. A new session is created
+        if there is none yet or the host or token changed in the array config.
+        :param array_context: The array to connect to.
+        :return: a FlashArray client. The purestorage client logs in again by itself if its session expires.
+        """
+        now = time.time()
+        self._close_idle(now)
+
+        entry = self._flasharrays.get(array_context.id)
+        if entry is not None:
+            host, api_token, client = entry[:3]
+            if host == array_context.host and api_token == array_context.api_token:
+                self._flasharrays[array_context.id] = (host, api_token, client, now)
+                return client
+
+            logger.info("Config of array '{}' changed, closing its session to {}".format(array_context.name, host))
+            self.invalidate_flasharray(array_context.id)
+
+        client = purestorage.FlashArray(
+            array_context.host, api_token=array_context.api_token, rest_version=ClientPool.REST_VERSION)
+        self._flasharrays[array_context.id] = (array_context.host, array_context.api_token, client, now)
+        return client
+
+    def invalidate_flasharray(self, array_id):
+        """
+        Close the pooled session of an array, e.g. when its config changed or it is no longer collected.
+        """
+        entry = self._flasharrays.pop(array_id, None)
+        if entry is not None:
+            try:
+                entry[2].invalidate_cookie()
+            except Exception as e:
+                logger.warn("Error when closing session to array {}: {}".format(entry[0], e))
+
+    def _close_idle(self, now):
+        for array_id, entry in list(self._flasharrays.items()):
+            if now - entry[3] >= self._idle_timeout:
+                logger.info("Array {} not collected for {} seconds, closing its session".format(
+                    entry[0], self._idle_timeout))
+                self.invalidate_flasharray(array_id)
+
+    def get_elasticsearch(self, hosts):
+        """
+        Get the shared Elasticsearch client for the given hosts.
+        """
+        client = self._es_clients.get(hosts)
+        if client is None:
+            client = Elasticsearch(hosts=hosts, retry_on_timeout=True, maxsize=self._es_maxsize)
+            self._es_clients[hosts] = client
+        return client
@@ -2,16 +2,30 @@
 """
     The global execution context of the worker
 """
+import time
+
 from celery.utils.log import get_task_logger
 from .store import Store
+from .scheduler import DeadlineScheduler
+from .arraycontext import ArrayContext
+from .membership import Membership, MAINTENANCE_KEY, scheduler_queue
 
 logger = get_task_logger(__name__)
 
 
 class Context(object):
-    def __init__(self, path):
+    def __init__(self, path, node_id=None, node_timeout=Membership.DEFAULT_TIMEOUT):
+        """
+        :param path: The path of the folder of the array configs, shared by all the worker nodes.
+        :param node_id: The id of this worker node, None if it is the only one.
+        :param node_timeout: Seconds after its last heartbeat a node is considered dead.
+        """
         self._array_contexts = {}
-        self._store = Store(path, logger)
+        self._store = Store(path, logger, node_id)
+        self._scheduler = DeadlineScheduler()
+        self._membership = Membership(path, node_id, logger, node_timeout) if node_id else None
+        # Ids of the arrays scheduled by this node. The context keeps all the arrays, e.g. for the retention sweep.
+        self._owned = set()
 
     def prepare(self):
         new_arrays = self._store.load_arrays()
@@ -34,10 +48,145 @@ class Context(object):
         # For arrays no longer exists in the config store, we remove it from the context
         for array_id in arrays_not_refreshed:
             del self._array_contexts[array_id]
+            self._scheduler.remove(array_id)
+
+        # Saved before the heartbeat releases any claim, so the next owner of an array finds its last state.
+        # The released arrays stay in the state file of this node until the next reload.
+        held = self._held()
+        if self._membership is not None:
+            self._store.save_array_states(self._arrays(held))
+            owned = self._membership.assign(self._array_contexts.values())
+        else:
+            owned = set(self._array_contexts)
+
+        # The arrays taken over from another node continue from their last collection by that node.
+        # The states are reloaded, the old node may have saved them since the configs were loaded.
+        taken_over = owned - self._owned
+        if taken_over and self._membership is not None:
+            new_arrays = self._store.load_arrays()
+        for array_id in taken_over:
+            if array_id in new_arrays and self._array_contexts[array_id].is_task_completed:
+                self._array_contexts[array_id].update_state_json(new_arrays[array_id].get_state_json())
+        for array_id in self._owned - owned:
+            self._scheduler.remove(array_id)
+        self._owned = owned
+
+        # Schedule the new arrays and the ones whose frequency changed, one interval after their last run.
+        now = time.time()
+        for array in self.owned_arrays:
+            if self._scheduler.frequency(array.id) != array.frequency:
+                not_before = max(now, array.task_starttime + array.frequency)
+                self._scheduler.push(
+                    array.id,
+                    DeadlineScheduler.next_deadline(array.id, array.frequency, not_before),
+                    array.frequency)
+
+        logger.info("Arrays for collections = {}".format(sorted(self._owned)))
+        self._store.save_array_states(self._arrays(held | self._held()))
+
+    def is_maintenance_node(self):
+        """
+        Whether this node runs the periodic tasks done once for all the nodes, e.g. the retention sweep.
+        """
+        return self._membership is None or self._membership.owns(MAINTENANCE_KEY)
+
+    def leave(self):
+        """
+        Stop scheduling, so the other nodes take over the arrays of this node right away.
+        """
+        if self._membership is not None:
+            self._membership.leave()
+
+    @property
+    def scheduler_queue(self):
+        """
+        The queue of the scheduling worker of this node, None for the default queue of a single node.
+        """
+        return scheduler_queue(self._membership.node_id) if self._membership is not None else None
+
+    @property
+    def owned_arrays(self):
+        """
+        The arrays scheduled by this node.
+        """
+        return self._arrays(self._owned)
+
+    def _held(self):
+        """
+        Ids of the arrays whose state this node saves: the ones it schedules and the ones whose last
+        collection it still runs after another node took them over.
+        """
+        return self._owned | self._membership.claimed if self._membership is not None else set(self._owned)
+
+    def _arrays(self, array_ids):
+        return [a for a in self._array_contexts.values() if a.id in array_ids]
 
-        logger.info("Arrays for collections = {}".format(self.array_contexts.keys()))
-        self._store.save_array_states(self.array_contexts.values())
 
+    def update_task_state(self, array_id, task_id, state):
+        """
+        Record the state reported by a task event of an array's collection.
+        :param array_id: The array collected by the task.
+        :param task_id: The id of the task.
+        :param state: The new state of the task.
+        """
+        array = self._current_array(array_id, task_id, state)
+        if array is None:
+            return
+
+        # Events could arrive out of order. A completed task never goes back to started.
+        if state == ArrayContext.TASK_STARTED and array.task_state in ArrayContext.TASK_COMPLETED_STATES:
+            return
+
+        # The cycle of a fanned out collection completes with its last volume chunk, like a chord.
+        if state in ArrayContext.TASK_COMPLETED_STATES and array.chunks_pending > 0:
+            array.deferred_state = state
+            return
+
+        if state == ArrayContext.TASK_SUCCESS and array.chunks_failed:
+            state = ArrayContext.TASK_FAILURE
+
+        array.task_state = state
+
+    def start_chunks(self, array_id, task_id, count):
+        """
+        Record that the collection task of an array fanned out its volumes to chunk tasks.
+        :param count: The number of chunk tasks sent.
+        """
+        array = self._current_array(array_id, task_id, "fanout")
+        if array is not None:
+            array.chunks_pending += count
+
+    def update_chunk_state(self, array_id, task_id, state):
+        """
+        Record the completion of one of the volume chunk tasks of a collection.
+        :param task_id: The id of the collection task that sent the chunk.
+        :param state: The completion state of the chunk task.
+        """
+        array = self._current_array(array_id, task_id, "chunk " + state)
+        if array is None or array.chunks_pending == 0:
+            return
+
+        array.chunks_pending -= 1
+        if state != ArrayContext.TASK_SUCCESS:
+            array.chunks_failed = True
+
+        if array.chunks_pending == 0 and array.deferred_state is not None:
+            self.update_task_state(array_id, task_id, array.deferred_state)
+
+    def _current_array(self, array_id, task_id, event):
+        array = self._array_contexts.get(array_id)
+        if array is None or array.task_id != task_id:
+            logger.info("Ignore {} event of stale task {} for array {}".format(event, task_id, array_id))
+            return None
+        return array
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def store(self):
+        return self._store
 
     @property
     def array_contexts(self):
@@ -0,0 +1,70 @@
+import time
+
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+
+class IndexCache(object):
+    """
+    Per-process cache of the Elasticsearch indices known to exist, so that each
+    index is created only once per day instead of on every collection.
+    The cache is cleared when the date rolls over, and the known indices are
+    periodically re-checked with a single request in case they were deleted
+    outside of the worker.
+    The index templates carrying the mappings and settings are installed before
+    the first index is created, and again once the known indices are forgotten.
+    """
+    DEFAULT_REVALIDATE_INTERVAL = 300  # In seconds
+
+    def __init__(self, revalidate_interval=DEFAULT_REVALIDATE_INTERVAL, templates=None):
+        """
+        :param revalidate_interval: Seconds between the checks of the known indices.
+        :param templates: list of (template name, template body) tuples.
+        """
+        self._revalidate_interval = revalidate_interval
+        self._templates = templates or []
+        self._templates_installed = False
+        self._date_str = None
+        self._indices = set()
+        self._validated_time = 0
+
+    def ensure_indices(self, es_client, indices, date_str):
+        """
+        Create the indices that are not known to exist yet.
+        :param es_client: The Elasticsearch client.
+        :param indices: list of index names.
+        :param date_str: The date of the collection, used to detect the rollover.
+        """
+        if date_str != self._date_str:
+            self._date_str = date_str
+            self._indices.clear()
+
+        now = time.time()
+        if self._indices and now - self._validated_time >= self._revalidate_interval:
+            # One HEAD request covering all the known indices. It fails if any of them is missing.
+            if not es_client.indices.exists(index=",".join(sorted(self._indices))):
+                logger.warn("Some of the indices {} no longer exist, recreating them".format(sorted(self._indices)))
+                self._indices.clear()
+                # ES may have lost the templates along with the indices
+                self._templates_installed = False
+            self._validated_time = now
+
+        if not self._templates_installed and any(i not in self._indices for i in indices):
+            for name, body in self._templates:
+                es_client.indices.put_template(name=name, body=body)
+            self._templates_installed = True
+
+        for index in indices:
+            if index not in self._indices:
+                # the mappings come from the templates. ignore indices already exists error (code 409)
+                es_client.indices.create(index=index, ignore=[400, 409])
+                self._indices.add(index)
+                self._validated_time = now
+
+    def invalidate(self):
+        """
+        Forget all the known indices and templates, so they are checked again on the next collection.
+        """
+        self._indices.clear()
+        self._templates_installed = False
@@ -0,0 +1,50 @@
+import time
+
+
+class InventoryCache(object):
+    """
+    Per-process cache of the slow-changing data of each array: its inventory of volumes, hosts,
+    host groups and connections, and their space usage. The collections between two refreshes
+    of a section reuse the data of the last one, so that most of them only make the monitor calls.
+    Missing data is fetched again whether its section is due or not, e.g. in another worker process.
+    """
+
+    def __init__(self):
+        # array id -> {key: data}
+        self._data = {}
+        # array id -> {section: start time of the collection that last refreshed it}
+        self._refreshed = {}
+
+    def due(self, array_id, section, frequency, period):
+        """
+        Whether a section of an array must be refreshed by the collection starting now.
+        :param frequency: The frequency of the section, in seconds.
+        :param period: The period of the collections. The section is refreshed by the collection closest
+                       to its frequency, so that a collection starting a bit early doesn't skip it.
+        """
+        last = self._refreshed.get(array_id, {}).get(section)
+        return last is None or time.time() - last >= frequency - period / 2.0
+
+    def refreshed(self, array_id, sections, start_time):
+        """
+        Record the sections refreshed by a successful collection.
+        """
+        refreshed = self._refreshed.setdefault(array_id, {})
+        for section in sections:
+            refreshed[section] = start_time
+
+    def get(self, array_id, key):
+        """
+        :return: The data last stored under the key, None if there is none.
+        """
+        return self._data.get(array_id, {}).get(key)
+
+    def put(self, array_id, key, data):
+        self._data.setdefault(array_id, {})[key] = data
+
+    def invalidate(self, array_id):
+        """
+        Forget all the data of an array, so that the next collection refreshes all its sections.
+        """
+        self._data.pop(array_id, None)
+        self._refreshed.pop(array_id, None)
@@ -0,0 +1,198 @@
+import json
+import os
+import time
+
+from .ring import HashRing
+
+# Folder of the heartbeat files, under the config folder. The heartbeats are renamed into it
+# every sweep, which would otherwise change the mtime of the config folder each time.
+NODES_DIR = ".pureelk.nodes"
+TMP_SUFFIX = ".tmp"
+
+# Key of the periodic tasks run by a single node for the whole cluster, e.g. the retention sweep.
+MAINTENANCE_KEY = "pureelk-maintenance"
+
+
+def scheduler_queue(node_id):
+    """
+    The queue of the scheduling worker of a node. It receives the periodic tasks of the node and
+    the task events of the collections it dispatched.
+    """
+    return "pureelk.scheduler.{}".format(node_id)
+
+
+class Membership(object):
+    """
+    The worker nodes sharing the config folder. Each node announces itself with a heartbeat file,
+    listing the arrays it claims. The arrays are assigned to the live nodes by a consistent-hash ring
+    of their ids, so a node joining or leaving only moves its share of them.
+
+    A node claims the arrays the ring gives it in two steps. The claim is first announced in its
+    heartbeat, and only becomes active, letting the node schedule the array, at a later assignment if
+    no other node holds an active claim or announced an earlier one. By then all the nodes see the
+    announced claims of each other and agree on the earliest one, so an array is never scheduled by
+    two nodes, even while they don't agree yet on the live nodes. The old owner of an array keeps
+    its active claim until its last collection completes.
+
+    The clocks of the nodes don't need to be in sync. A node is alive as long as its heartbeat keeps
+    changing, as seen by the clock of the node reading it, and the times of the claims only order
+    the claims announced at about the same time.
+    """
+    DEFAULT_TIMEOUT = 30  # In seconds. A node is dead if its heartbeat didn't change for longer.
+
+    # Heartbeat files are deleted once unchanged for this many timeouts, e.g. of nodes renamed since.
+    EXPIRED_TIMEOUTS = 10
+
+    def __init__(self, path, node_id, logger, timeout=DEFAULT_TIMEOUT):
+        """
+        :param path: The config folder shared by the nodes.
+        """
+        self._path = os.path.join(path, NODES_DIR)
+        self._node_id = node_id
+        self._logger = logger
+        self._timeout = timeout
+        # array id -> (time this node announced its claim, whether the claim is active)
+        self._claims = {}
+        # node id -> (time written in its heartbeat, local time this node first read it)
+        self._seen = {}
+        self._ring = None
+        self._joined = False
+
+    @property
+    def node_id(self):
+        return self._node_id
+
+    @property
+    def claimed(self):
+        """
+        Ids of the arrays actively claimed by this node as of the last assignment, including the ones
+        it no longer owns but still collects.
+        """
+        return set(array_id for array_id, (since, active) in self._claims.items() if active)
+
+    def assign(self, arrays):
+        """
+        Send the heartbeat of this node and work out the arrays it schedules.
+        :param arrays: The ArrayContexts of all the arrays.
+        :return: set of the ids of the arrays scheduled by this node.
+        """
+        now = time.time()
+        others = self._live_nodes(now)
+        ring = HashRing(list(others) + [self._node_id])
+        if self._ring is None or ring.nodes != self._ring.nodes:
+            self._logger.info("Worker nodes are now {}".format(ring.nodes))
+        self._ring = ring
+
+        claims = {}
+        owned = set()
+        for array in arrays:
+            mine = ring.owner(array.id) == self._node_id
+            since, active = self._claims.get(array.id, (now, False))
+            if not mine and not (active and not array.is_task_completed):
+                continue
+
+            # (time announced, node) of the claims of the other nodes, active and announced ones.
+            other_active = []
+            other_announced = []
+            for node, other_claims in others.items():
+                if array.id in other_claims:
+                    other_since, other_is_active = other_claims[array.id]
+                    (other_active if other_is_active else other_announced).append((other_since, node))
+
+            if active:
+                # Only if two nodes activated at once, e.g. the heartbeats were seen late, the earliest keeps it.
+                active = all((since, self._node_id) < other for other in other_active)
+            elif array.id in self._claims:
+                # Announced at the last assignment at least, so the other nodes had time to see it.
+                active = not other_active and all((since, self._node_id) < other for other in other_announced)
+
+            if active or mine:
+                claims[array.id] = (since, active)
+            if active and mine:
+                owned.add(array.id)
+
+        for array_id in self.claimed - set(a for a, (s, active) in claims.items() if active):
+            self._logger.info("Released array {}".format(array_id))
+        for array_id in set(a for a, (s, active) in claims.items() if active) - self.claimed:
+            self._logger.info("Claimed array {}".format(array_id))
+        self._claims = claims
+
+        self._write_heartbeat(now)
+        return owned
+
+    def owns(self, key):
+        """
+        Whether this node owns a key of the ring, as of the last assignment.
+        """
+        return self._ring is not None and self._ring.owner(key) == self._node_id
+
+    def leave(self):
+        """
+        Delete the heartbeat of this node, so the other nodes take over its arrays right away.
+        """
+        if not self._joined:
+            return
+        try:
+            os.remove(self._heartbeat_path(self._node_id))
+        except OSError as e:
+            self._logger.warn("Error when removing the heartbeat of node {}: {}".format(self._node_id, e))
+        self._joined = False
+
+    def _live_nodes(self, now):
+        """
+        :return: dict of node id -> claims of the other live nodes.
+        """
+        if not os.path.isdir(self._path):
+            return {}
+
+        nodes = {}
+        seen = {}
+        for file_name in os.listdir(self._path):
+            if file_name.endswith(TMP_SUFFIX):
+                continue
+
+            path = os.path.join(self._path, file_name)
+            try:
+                with open(path) as heartbeat_file:
+                    heartbeat = json.load(heartbeat_file)
+            except Exception as e:
+                self._logger.warn("Exception at loading heartbeat {}: {}".format(file_name, e))
+                continue
+
+            node = heartbeat["node"]
+            if node == self._node_id:
+                continue
+
+            # The age of a heartbeat is measured by the clock of this node, from when it last changed.
+            last = self._seen.get(node)
+            seen[node] = last if last is not None and last[0] == heartbeat["time"] else (heartbeat["time"], now)
+            age = now - seen[node][1]
+            if age < self._timeout:
+                nodes[node] = heartbeat["claims"]
+            elif age >= self._timeout * Membership.EXPIRED_TIMEOUTS:
+                self._logger.info("Removing the heartbeat of node {}, dead since {:.0f} seconds".format(node, age))
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._seen = seen
+        return nodes
+
+    def _write_heartbeat(self, now):
+        if not os.path.isdir(self._path):
+            try:
+                os.makedirs(self._path)
+            except OSError:
+                # e.g. created by another node in the meantime
+                if not os.path.isdir(self._path):
+                    raise
+
+        # Written to a temporary file then renamed, so the other nodes never read a partial heartbeat.
+        path = self._heartbeat_path(self._node_id)
+        with open(path + TMP_SUFFIX, 'w') as heartbeat_file:
+            heartbeat_file.write(json.dumps({"node": self._node_id, "time": now, "claims": self._claims}))
+        os.rename(path + TMP_SUFFIX, path)
+        self._joined = True
+
+    def _heartbeat_path(self, node_id):
+        return os.path.join(self._path, node_id)
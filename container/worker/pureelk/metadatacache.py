@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+
+class MetadataCache(object):
+    """
+    Per-process cache of the metadata of the arrays that never or rarely changes, keyed by object
+    name: the serial and the connections of each volume, and the id and version of each array.
+    Unlike the inventory cache, it doesn't need the whole inventory of an array, so the volume
+    chunks of a fanned out collection only fetch the metadata of the volumes they never saw.
+    Entries expire after a TTL, and the least recently used ones are evicted beyond a maximum size.
+    Each refresh of the inventory replaces the entries of its objects, dropping the renamed and
+    deleted ones.
+    """
+    DEFAULT_TTL = 86400  # In seconds
+    DEFAULT_MAX_SIZE = 200000  # Number of entries of all the arrays
+
+    # Kinds of metadata
+    SERIAL = "serial"  # volume name -> serial
+    CONNECTIONS = "connections"  # volume name -> (hosts, host groups)
+    ARRAY = "array"  # array host -> (id, version)
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self._ttl = ttl
+        self._max_size = max_size
+        # (array id, kind, name) -> (value, time stored), least recently used first
+        self._entries = OrderedDict()
+
+    def get(self, array_id, kind, name):
+        """
+        :return: The value of an object, None if it is not cached or expired.
+        """
+        key = (array_id, kind, name)
+        entry = self._entries.pop(key, None)
+        if entry is None or time.time() - entry[1] >= self._ttl:
+            return None
+
+        # reinserted as the most recently used
+        self._entries[key] = entry
+        return entry[0]
+
+    def get_many(self, array_id, kind, names):
+        """
+        :return: dict of name -> value of the objects, None unless they are all cached.
+        """
+        values = {}
+        for name in names:
+            value = self.get(array_id, kind, name)
+            if value is None:
+                return None
+            values[name] = value
+        return values
+
+    def put(self, array_id, kind, name, value):
+        key = (array_id, kind, name)
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.time())
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def put_many(self, array_id, kind, values):
+        """
+        :param values: dict of name -> value.
+        """
+        for name, value in values.items():
+            self.put(array_id, kind, name, value)
+
+    def sync(self, array_id, kind, values):
+        """
+        Replace all the metadata of a kind of an array with the latest inventory, e.g. of all its volumes.
+        :param values: dict of name -> value of all the objects.
+        """
+        stale = [key for key, entry in self._entries.items()
+                 if key[0] == array_id and key[1] == kind and
+                 (key[2] not in values or entry[0] != values[key[2]])]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            logger.info("Dropped the {} of {} renamed, deleted or changed objects of array {}".format(
+                kind, len(stale), array_id))
+
+        self.put_many(array_id, kind, values)
+
+    def invalidate(self, array_id):
+        """
+        Forget all the metadata of an array.
+        """
+        for key in [k for k in self._entries if k[0] == array_id]:
+            del self._entries[key]
@@ -0,0 +1,116 @@
+import time
+from contextlib import contextmanager
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    Nearest-rank percentiles of a list of values, plus the max.
+    :return: dictionary like {"p50": ..., "p90": ..., "p99": ..., "max": ...}, empty if there is no value.
+    """
+    if not values:
+        return {}
+
+    ordered = sorted(values)
+    result = dict(("p{}".format(p), ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]) for p in points)
+    result["max"] = ordered[-1]
+    return result
+
+
+class CollectionMetrics(object):
+    """
+    Instrumentation of one collection of an array: wall time per section, FlashArray REST calls,
+    Elasticsearch requests, documents produced and scheduling lag.
+    """
+
+    def __init__(self, schedule_lag=None):
+        self._start = time.time()
+        self._schedule_lag = schedule_lag
+        self._sections = {}
+        self._rest_latencies = []
+        self._rest_errors = 0
+        self._es_latencies = []
+        self._es_bytes = 0
+        self._documents = 0
+
+    @property
+    def schedule_lag(self):
+        return self._schedule_lag
+
+    @property
+    def sections(self):
+        return self._sections
+
+    @property
+    def rest_errors(self):
+        return self._rest_errors
+
+    @property
+    def documents(self):
+        return self._documents
+
+    @contextmanager
+    def section(self, name):
+        """
+        Measure the wall time of a section of the collection.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._sections[name] = time.time() - start
+
+    def record_rest_call(self, latency, error=False):
+        self._rest_latencies.append(latency)
+        if error:
+            self._rest_errors += 1
+
+    def record_es_request(self, size, latency):
+        self._es_latencies.append(latency)
+        self._es_bytes += size
+
+    def record_document(self):
+        self._documents += 1
+
+    def get_json(self):
+        """
+        :return: The metrics as a document to be indexed.
+        """
+        return {
+            "total_secs": time.time() - self._start,
+            "section_secs": dict(self._sections),
+            "rest_calls": len(self._rest_latencies),
+            "rest_errors": self._rest_errors,
+            "rest_latency_ms": dict((k, v * 1000) for k, v in percentiles(self._rest_latencies).items()),
+            "es_requests": len(self._es_latencies),
+            "es_bytes": self._es_bytes,
+            "es_latency_ms": dict((k, v * 1000) for k, v in percentiles(self._es_latencies).items()),
+            "documents": self._documents,
+            "schedule_lag_secs": self._schedule_lag
+        }
+
+
+class InstrumentedClient(object):
+    """
+    Proxy of a FlashArray client that records the count and latency of every REST call.
+    """
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.time()
+            error = True
+            try:
+                result = attr(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                self._metrics.record_rest_call(time.time() - start, error)
+
+        return call
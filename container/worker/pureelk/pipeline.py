@@ -0,0 +1,51 @@
+import gevent
+from gevent.queue import Queue
+
+# Marks the end of the items in a queue.
+_END = object()
+
+
+class Pipeline(object):
+    """
+    Runs the stages of a streaming collection in their own greenlets, connected by bounded queues,
+    so that fetching the next page from the array overlaps with indexing the previous one, while
+    at most a few pages are in memory at any time. A stage blocks when the next one is behind.
+    """
+    DEFAULT_MAXSIZE = 2  # Items waiting between two stages
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self._maxsize = maxsize
+
+    def run(self, source, *stages):
+        """
+        Feed the items of the source through the stages, the output of each stage being the input of the next.
+        Raises the exception of the first stage that fails, after stopping the others.
+        :param source: Iterable of the items, e.g. a generator fetching pages of documents.
+        :param stages: Functions of one item. The output of the last one is dropped.
+        """
+        queues = [Queue(self._maxsize) for _ in stages]
+        greenlets = [gevent.spawn(self._feed, source, queues[0])]
+        for i, stage in enumerate(stages):
+            output = queues[i + 1] if i + 1 < len(stages) else None
+            greenlets.append(gevent.spawn(self._stage, stage, queues[i], output))
+
+        try:
+            gevent.joinall(greenlets, raise_error=True)
+        finally:
+            # The stages before a failed one would otherwise block forever on a full queue.
+            gevent.killall(greenlets)
+
+    @staticmethod
+    def _feed(source, output):
+        for item in source:
+            output.put(item)
+        output.put(_END)
+
+    @staticmethod
+    def _stage(stage, input, output):
+        for item in iter(input.get, _END):
+            result = stage(item)
+            if output is not None:
+                output.put(result)
+        if output is not None:
+            output.put(_END)
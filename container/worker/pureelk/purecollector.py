@@ -1,162 +1,233 @@
 from celery.utils.log import get_task_logger
+from elasticsearch.exceptions import TransportError
+from gevent.pool import Pool
 import json
 import datetime
+import time
 
+from .arraycontext import ArrayContext
+from .metrics import CollectionMetrics, InstrumentedClient
+from .bulkindexer import is_retryable
+from .topology import Topology, names_string
+from .retention import ttl_group
+from .pipeline import Pipeline
+from .metadatacache import MetadataCache
 
-# setup the mappings for the index
-volmap = """
-{
-    "mappings" : {
-        "volperf":{
-            "properties":{
-                "name":{"type":"string","index":"not_analyzed"},
-                "vol_name":{"type":"string","index":"not_analyzed"},
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
-
-hostmap = """
-{
-    "mappings" : {
-        "hostdoc":{
-            "properties":{
-                "name":{"type":"string","index":"not_analyzed"},
-                "host_name":{"type":"string","index":"not_analyzed"},
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
-
-hgroupmap = """
-{
-    "mappings" : {
-        "hgroupdoc":{
-            "properties":{
-                "name":{"type":"string","index":"not_analyzed"},
-                "hgroup_name":{"type":"string","index":"not_analyzed"},
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
-
-arraymap = """
-{
-    "mappings" : {
-        "arrayperf":{
-            "properties":{
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"},
-                "hostname":{"type":"string","index":"not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
-
-msgmap = """
-{
-    "mappings" : {
-        "arraymsg":{
-            "properties":{
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"},
-                "category":{"type": "string", "index": "not_analyzed"},
-                "current_severity":{"type": "string", "index": "not_analyzed"},
-                "actual":{"type": "string", "index": "not_analyzed"},
-                "component_name":{"type": "string", "index": "not_analyzed"},
-                "component_type":{"type": "string", "index": "not_analyzed"},
-                "details":{"type": "string", "index": "not_analyzed"},
-                "expected":{"type": "string", "index": "not_analyzed"},
-                "event":{"type": "string", "index": "not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
-
-auditmap = """
-{
-    "mappings" : {
-        "auditmsg":{
-            "properties":{
-                "array_name":{"type":"string","index":"not_analyzed"},
-                "array_id":{"type":"string","index":"not_analyzed"},
-                "component_name":{"type":"string","index":"not_analyzed"},
-                "component_type":{"type":"string","index":"not_analyzed"},
-                "details":{"type":"string","index":"not_analyzed"},
-                "event":{"type":"string","index":"not_analyzed"},
-                "user":{"type":"string","index":"not_analyzed"}
-            },
-            "_ttl" : { "enabled" : true }
-        }
-    }
-}
-"""
 
 class PureCollector(object):
     _timeofquery_key = 'timeofquery'
 
-    def __init__(self, ps_client, es_client, array_context):
-        self._ps_client = ps_client;
+    # Keys of the high-water marks of the message ids already indexed.
+    MESSAGES_MARK = 'messages'
+    AUDIT_MARK = 'audit'
+    OPEN_SUFFIX = '_open'
+
+    def __init__(self, ps_client, es_client, bulk_indexer, index_cache, array_context, watermarks=None, metrics=None,
+                 change_cache=None, fanout=None, inventory_cache=None, metadata_cache=None):
+        self._metrics = metrics if metrics is not None else CollectionMetrics()
+        # count and time every REST call made to the array
+        self._ps_client = InstrumentedClient(ps_client, self._metrics)
         self._es_client = es_client;
+        self._index_cache = index_cache
+        self._change_cache = change_cache
+        # the inventory and space usage are only refreshed at their own frequencies
+        self._inventory_cache = inventory_cache
+        self._frequency = array_context.frequency
+        self._frequencies = array_context.frequencies
+        self._refresh = set(ArrayContext.SECTIONS)
+        # the serials and connections of the volumes by name, and the id and version of the array
+        self._metadata_cache = metadata_cache
+        # All the documents, time-series and global, go through the same bulk stream.
+        self._indexer = bulk_indexer
         self._array_name = array_context.name
         self._array_id = array_context.id
-        self._data_ttl = array_context.data_ttl
+        self._array_host = array_context.host
+        # the daily indices are grouped by TTL, so they can be deleted whole once expired
+        self._ttl_group = ttl_group(array_context.data_ttl)
+        self._collection_mode = array_context.collection_mode
+        self._concurrency = array_context.collect_concurrency
+        # function(list of volume name chunks, timeofquery, refreshed sections) sending the volume chunks to other tasks
+        self._fanout = fanout
+        self._fanout_volumes = array_context.fanout_volumes
+        self._fanout_chunk_size = array_context.fanout_chunk_size
+        # the volumes and hosts are streamed through a pipeline, a page at a time
+        self._volume_page_size = array_context.volume_page_size
+        self._pipeline = Pipeline()
+        self._watermarks = dict(watermarks) if watermarks else {}
         self.logger = get_task_logger(__name__)
 
     def collect(self):
+        start_time = time.time()
         utcnow = datetime.datetime.utcnow()
 
         date_str = utcnow.strftime('%Y-%m-%d')
-        arrays_index = "pureelk-arrays-{}".format(date_str)
-        vols_index = "pureelk-vols-{}".format(date_str)
-        hosts_index = "pureelk-hosts-{}".format(date_str)
-        hgroups_index = "pureelk-hgroup-{}".format(date_str)
-        msgs_index = "pureelk-msgs-{}".format(date_str)
-        audit_index = "pureelk-audit-{}".format(date_str)
-        global_arrays_index = "pureelk-global-arrays"
-        global_vols_index = "pureelk-global-vols"
-
-        # ignore indices already exists error (code 409)
-        self._es_client.indices.create(index=vols_index, body=volmap, ignore=[400, 409])
-        self._es_client.indices.create(index=arrays_index, body=arraymap, ignore=[400, 409])
-        self._es_client.indices.create(index=msgs_index, body=msgmap, ignore=[400, 409])
-        self._es_client.indices.create(index=audit_index, body=auditmap, ignore=[400, 409])
-        self._es_client.indices.create(index=hosts_index, body=hostmap, ignore=[400, 409])
-        self._es_client.indices.create(index=hgroups_index, body=hgroupmap, ignore=[400, 409])
-
-
-        #special non-time series stash of array/vol documents
-        self._es_client.indices.create(index=global_arrays_index, body=arraymap, ignore=[400, 409])
-        self._es_client.indices.create(index=global_vols_index, body=volmap, ignore=[400, 409])
+        self._set_indices(date_str)
+
+        # create the indices unless this process already knows they exist.
+        # the global indices are special non-time series stash of array/vol documents
+        self._ensure_indices([
+            self._vols_index,
+            self._arrays_index,
+            self._msgs_index,
+            self._audit_index,
+            self._hosts_index,
+            self._hgroups_index,
+            self._global_arrays_index,
+            self._global_vols_index,
+            self._internal_index
+        ], date_str)
 
         # all metrics collected in the same cycle are posted to Elasticsearch with same timestamp
-        timeofquery_str = utcnow.isoformat()
-
+        self._timeofquery_str = utcnow.isoformat()
+        self._refresh = self._due_sections()
+
+        # The sections don't depend on each other, so they are fetched concurrently,
+        # at most self._concurrency of them at a time, all of them by default. The volume,
+        # host and host group sections share the connection snapshot, fetched first.
+        sections = [
+            ('array', self._collect_array),
+            ('messages', self._collect_messages),
+            ('audit', self._collect_audit),
+            ('volumes', self._collect_volumes)
+        ]
+        if ArrayContext.SECTION_SPACE in self._refresh:
+            # the host and host group documents only have space usage
+            sections += [
+                ('hosts', self._collect_hosts),
+                ('hgroups', self._collect_hgroups)
+            ]
+        self._run_sections(sections)
+
+        # only reached if all the sections succeeded, otherwise they are all refreshed again next time.
+        if self._inventory_cache is not None:
+            self._inventory_cache.refreshed(self._array_id, self._refresh, start_time)
+
+    def collect_volumes(self, names, timeofquery_str, refresh=None):
+        """
+        Collect some of the volumes only, as one chunk of a fanned out collection.
+        :param names: The names of the volumes to collect.
+        :param timeofquery_str: The time of query of the whole collection, shared by all its chunks.
+        :param refresh: The sections refreshed by the whole collection, None for all of them.
+        """
+        # the chunks go to the daily indices of the collection that sent them, even past midnight
+        date_str = timeofquery_str[:10]
+        self._set_indices(date_str)
+        self._ensure_indices([self._vols_index, self._global_vols_index, self._internal_index], date_str)
+        self._timeofquery_str = timeofquery_str
+        self._refresh = set(refresh) if refresh is not None else set(ArrayContext.SECTIONS)
+
+        self._run_sections([('volumes', lambda: self._collect_volumes(names))], volume_names=names)
+
+    def _due_sections(self):
+        """
+        :return: The sections refreshed by this collection. The monitor section is collected every time.
+        """
+        if self._inventory_cache is None:
+            return set(ArrayContext.SECTIONS)
+        return set([ArrayContext.SECTION_MONITOR] + [
+            section for section in [ArrayContext.SECTION_SPACE, ArrayContext.SECTION_INVENTORY]
+            if self._inventory_cache.due(self._array_id, section, self._frequencies[section], self._frequency)])
+
+    def _cached(self, key, section, fetch):
+        """
+        Data of a slow-changing section, from the inventory cache unless the section is due.
+        :param key: The key of the data in the cache.
+        :param fetch: Function fetching the data from the array.
+        """
+        data = self._inventory_cache.get(self._array_id, key) \
+            if self._inventory_cache is not None and section not in self._refresh \
+            else None
+        if data is None:
+            data = fetch()
+            if self._inventory_cache is not None:
+                self._inventory_cache.put(self._array_id, key, data)
+        return data
+
+    def _set_indices(self, date_str):
+        suffix = "{}-{}".format(self._ttl_group, date_str)
+        self._arrays_index = "pureelk-arrays-{}".format(suffix)
+        self._vols_index = "pureelk-vols-{}".format(suffix)
+        self._hosts_index = "pureelk-hosts-{}".format(suffix)
+        self._hgroups_index = "pureelk-hgroup-{}".format(suffix)
+        self._msgs_index = "pureelk-msgs-{}".format(suffix)
+        self._audit_index = "pureelk-audit-{}".format(suffix)
+        self._global_arrays_index = "pureelk-global-arrays"
+        self._global_vols_index = "pureelk-global-vols"
+        self._internal_index = "pureelk-internal-{}".format(suffix)
+
+    def _ensure_indices(self, indices, date_str):
+        try:
+            self._index_cache.ensure_indices(self._es_client, indices, date_str)
+        except TransportError as e:
+            # With a spool, the documents wait on disk and the spool drainer creates the indices later.
+            if not self._indexer.spooling or not is_retryable(e):
+                raise
+            self.logger.warn("Elasticsearch is unavailable, documents of array '{}' will be spooled: {}".format(
+                self._array_name, e))
+
+    def _run_sections(self, sections, volume_names=None):
+        """
+        Run the sections of a collection, then index its performance and flush the documents.
+        Raises the exception of the first failed section.
+        :param sections: list of (name, function).
+        :param volume_names: The volumes whose connections are fetched, None for all of them.
+        """
+        # The topology runs alongside the sections.
+        pool = Pool(self._concurrency or len(sections) + 1)
+        self._topology = pool.spawn(self._collect_section, 'topology', lambda: self._get_topology(volume_names))
+        sections = [('topology', self._topology)] + \
+                   [(name, pool.spawn(self._collect_section, name, section)) for name, section in sections]
+        try:
+            pool.join()
+        except BaseException:
+            # e.g. the time limit of the task, the sections must not keep running after it.
+            pool.kill()
+            raise
+
+        failed = [(name, greenlet) for name, greenlet in sections if not greenlet.successful()]
+        for name, greenlet in failed:
+            self.logger.error("Collection of array '{}' failed in {}: {}".format(
+                self._array_name, name, greenlet.exception))
+
+        # the collector's own performance goes to the internal index, in the same bulk stream
+        perf = self._metrics.get_json()
+        perf['array_name'] = self._array_name
+        perf['array_id'] = self._array_id
+        perf['failed_sections'] = [name for name, greenlet in failed]
+        perf['refreshed_sections'] = sorted(self._refresh)
+        perf[PureCollector._timeofquery_key] = self._timeofquery_str
+        self._indexer.index(index=self._internal_index, doc_type='collectorperf', body=perf)
+
+        # send whatever is left in the last partial batch
+        self._indexer.flush()
+
+        if failed:
+            raise failed[0][1].exception
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def _collect_section(self, name, section):
+        with self._metrics.section(name):
+            return section()
+
+    @property
+    def watermarks(self):
+        """
+        The high-water marks of the messages indexed so far, to be persisted for the next collection.
+        """
+        return self._watermarks
+
+    def _collect_array(self):
         # get the overall array info for performance
         ap = self._ps_client.get(action='monitor')
         ap[0]['array_name'] = self._array_name
         ap[0]['array_id'] = self._array_id
-        # add an array name that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-        ap[0]['array_name_a'] = self._array_name
+        ap[0]['purity_version'] = self._array_version()
 
-        # now get the information for space
-        sp = self._ps_client.get(space=True)
+        # now get the information for space, unless it is not due yet
+        sp = self._cached('array_space', ArrayContext.SECTION_SPACE, lambda: self._ps_client.get(space=True))
         nd = sp.copy()
 
         # copy items into the new dictionary
@@ -169,131 +240,307 @@ class PureCollector(object):
         ap[0]['free'] = cap - tot
         ap[0]['percent_free'] = (float(cap) - float(tot)) / float(cap)
 
-        ap[0][PureCollector._timeofquery_key] = timeofquery_str
+        ap[0][PureCollector._timeofquery_key] = self._timeofquery_str
         s = json.dumps(ap[0])
-        self._es_client.index(index=arrays_index, doc_type='arrayperf', body=s, ttl=self._data_ttl)
+        self._indexer.index(index=self._arrays_index, doc_type='arrayperf', body=s)
 
         # non-timeseries array docs, uses id to bring es versioning into play
-        self._es_client.index(index=global_arrays_index, doc_type='arrayperf', body=s, id=self._array_id, ttl=self._data_ttl)
-
-
-        # index alert messages
+        self._index_global(self._global_arrays_index, 'arrayperf', self._array_id, ap[0], s)
+
+    def _array_version(self):
+        """
+        The Purity version of the array, once it is checked that the configured host is still the same array.
+        """
+        identity = self._metadata_cache.get(self._array_id, MetadataCache.ARRAY, self._array_host) \
+            if self._metadata_cache is not None \
+            else None
+        if identity is None:
+            info = self._ps_client.get()
+            if info['id'] != self._array_id:
+                raise ValueError("Array at {} has id {}, the config of array '{}' expects id {}".format(
+                    self._array_host, info['id'], self._array_name, self._array_id))
+
+            identity = (info['id'], info['version'])
+            if self._metadata_cache is not None:
+                self._metadata_cache.put(self._array_id, MetadataCache.ARRAY, self._array_host, identity)
+        return identity[1]
+
+    def _collect_messages(self):
+        # index alert messages. Alerts that are still open are sent again since their
+        # state may change, everything else only once.
         al = self._ps_client.list_messages(recent='true')
-        for am in al:
-            am['array_name'] = self._array_name
-            am['array_id'] = self._array_id
-            # add an array name  that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-            am['array_name_a'] = self._array_name
-            am[PureCollector._timeofquery_key] = timeofquery_str
-            s = json.dumps(am)
-            self._es_client.index(index=msgs_index, doc_type='arraymsg', id=am['id'], body=s, ttl=self._data_ttl)
+        self._index_new_messages(al, PureCollector.MESSAGES_MARK, self._msgs_index, 'arraymsg', track_open=True)
 
+    def _collect_audit(self):
         # index audit log entries
         al = self._ps_client.list_messages(audit='true')
-        for am in al:
+        self._index_new_messages(al, PureCollector.AUDIT_MARK, self._audit_index, 'auditmsg')
+
+    def _index_new_messages(self, messages, mark_key, index, doc_type, track_open=False):
+        """
+        Index the messages newer than the high-water mark of their kind, then move the mark.
+        Without a mark, or if the array's ids went backwards, all the messages are indexed again.
+        """
+        mark = self._watermarks.get(mark_key)
+        open_key = mark_key + PureCollector.OPEN_SUFFIX
+        open_ids = set(self._watermarks.get(open_key, []))
+        latest = max(am['id'] for am in messages) if messages else None
+
+        if mark is not None and latest is not None and latest < mark:
+            self.logger.warn("Latest {} id {} of array '{}' is below the mark {}, resyncing".format(
+                mark_key, latest, self._array_name, mark))
+            mark = None
+
+        still_open = []
+        for am in messages:
+            if track_open and not am.get('closed'):
+                still_open.append(am['id'])
+
+            if mark is not None and am['id'] <= mark and am['id'] not in open_ids:
+                continue
+
             am['array_name'] = self._array_name
             am['array_id'] = self._array_id
-            # add an array name  that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-            am['array_name_a'] = self._array_name
-            am[PureCollector._timeofquery_key] = timeofquery_str
+            am[PureCollector._timeofquery_key] = self._timeofquery_str
             s = json.dumps(am)
-            self._es_client.index(index=audit_index, doc_type='auditmsg', id=am['id'], body=s, ttl=self._data_ttl)
-
-        # get list of volumes
-        vl = self._ps_client.list_volumes()
-
-        for v in vl:
-            # get real-time perf stats per volume
-            vp = self._ps_client.get_volume(v['name'], action='monitor')
-            vp[0]['array_name'] = self._array_name
-            vp[0]['array_id'] = self._array_id
-            vp[0]['vol_name'] = self._array_name + ':' + v['name']
-            
-            # add an array name and a volume name that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-            vp[0]['vol_name_a'] = v['name']
-            vp[0]['array_name_a'] = self._array_name
-            
-            vp[0][PureCollector._timeofquery_key] = timeofquery_str
-            
-            # get space stats per volume and append 
-            vs = self._ps_client.get_volume(v['name'], space=True)
-            vp[0].update(vs)
-
-            # get the host and host group connections per volume
-            # create a large string that we are hoping elasticsearch
-            # will tokenize and help us match
-            hs =""
-            hgs=""
-            hp = self._ps_client.list_volume_private_connections(v['name'])
-            for h in hp:
-                if h['host']:
-                    hs += h['host']
-                    hs += ' '
-
-            hp = self._ps_client.list_volume_shared_connections(v['name'])
-            for hg in hp:
-                if hg['host']:
-                    hs += hg['host']
-                    hs += ' '
-                if hg['hgroup']:
-                    hgs += hg['hgroup']
-                    hgs += ' '
-
-            vp[0]['host_name'] = hs
-            vp[0]['hgroup_name'] = hgs
-
-            # get the serial number for this volume to use as a unique global id
-            vp1 = self._ps_client.get_volume(v['name'])
-            vp[0]['serial'] = vp1['serial']
-            
-            # dump total document into json
-            s = json.dumps(vp[0])
-            self._es_client.index(index=vols_index, doc_type='volperf', body=s, ttl=self._data_ttl)
+            self._indexer.index(index=index, doc_type=doc_type, id=am['id'], body=s)
+
+        if latest is not None:
+            self._watermarks[mark_key] = latest
+        if track_open:
+            self._watermarks[open_key] = still_open
+
+    def _get_topology(self, volume_names=None):
+        if volume_names is None:
+            return self._cached('topology', ArrayContext.SECTION_INVENTORY, lambda: Topology.fetch(self._ps_client))
+
+        # a chunk only fetches the connections of its volumes the first time it sees them, or when the inventory is due
+        connections = self._cached_metadata(MetadataCache.CONNECTIONS, volume_names)
+        if connections is not None:
+            return Topology.from_volumes(connections)
+
+        topology = Topology.fetch(self._ps_client, volume_names, self._volume_page_size)
+        if self._metadata_cache is not None:
+            self._metadata_cache.put_many(self._array_id, MetadataCache.CONNECTIONS,
+                                          dict((name, topology.volume_connections(name)) for name in volume_names))
+        return topology
+
+    def _cached_metadata(self, kind, names):
+        """
+        :return: dict of name -> metadata of the objects, None if the inventory is due or some of them are not cached.
+        """
+        if self._metadata_cache is None or ArrayContext.SECTION_INVENTORY in self._refresh:
+            return None
+        return self._metadata_cache.get_many(self._array_id, kind, names)
+
+    def _sync_metadata(self, inventory):
+        """
+        Replace the metadata of the volumes with the refreshed inventory, for the chunks collected by this process.
+        """
+        if self._metadata_cache is None:
+            return
+
+        topology = self._topology.get()
+        self._metadata_cache.sync(self._array_id, MetadataCache.SERIAL, dict(inventory))
+        self._metadata_cache.sync(self._array_id, MetadataCache.CONNECTIONS,
+                                  dict((name, topology.volume_connections(name)) for name, serial in inventory))
+
+    def _collect_volumes(self, names=None):
+        """
+        :param names: The names of the volumes to collect, None for all of them.
+        """
+        # the inventory is the names and serials of the volumes, the rest is fetched page by page
+        kwargs = {'names': ','.join(names)} if names is not None else {}
+        if names is None:
+            inventory = self._cached('volumes', ArrayContext.SECTION_INVENTORY, self._list_inventory)
+            if ArrayContext.SECTION_INVENTORY in self._refresh:
+                self._prune_volume_space(inventory)
+                self._sync_metadata(inventory)
+        else:
+            serials = self._cached_metadata(MetadataCache.SERIAL, names)
+            if serials is not None:
+                inventory = [(name, serials[name]) for name in names]
+            else:
+                inventory = self._list_inventory(names)
+                if self._metadata_cache is not None:
+                    self._metadata_cache.put_many(self._array_id, MetadataCache.SERIAL, dict(inventory))
+
+        if names is None and self._fanout is not None and self._fanout_volumes is not None \
+                and len(inventory) > self._fanout_volumes:
+            # too many volumes for a single task, let parallel chunk tasks collect them
+            size = self._fanout_chunk_size
+            chunks = [[name for name, serial in inventory[i:i + size]] for i in range(0, len(inventory), size)]
+            self._fanout(chunks, self._timeofquery_str, sorted(self._refresh))
+            return
+
+        serials = []
+        self._pipeline.run(
+            self._volume_pages(inventory, kwargs),
+            self._enrich_volumes,
+            self._serialize,
+            lambda page: self._index_volumes(page, serials))
+
+        # a chunk only knows about its own volumes
+        if self._change_cache is not None and names is None:
+            self._change_cache.prune(self._array_id, self._global_vols_index, serials)
+
+    def _list_inventory(self, names=None):
+        """
+        :param names: The names of the volumes to list, None for all of them.
+        :return: list of (name, serial) of the volumes.
+        """
+        if names is None:
+            return [(v['name'], v['serial']) for v in self._ps_client.list_volumes()]
+
+        # the names are sent in the URL, a page of them at a time like the rest of the volume data
+        page_size = self._volume_page_size
+        inventory = []
+        for i in range(0, len(names), page_size):
+            inventory += [(v['name'], v['serial'])
+                          for v in self._ps_client.list_volumes(names=','.join(names[i:i + page_size]))]
+        return inventory
+
+    def _volumes_space(self, page, fetch):
+        """
+        The space usage of a page of volumes by name, from the inventory cache unless the space section
+        is due or some of the volumes are not cached yet.
+        :param fetch: Function fetching the space usage of the page from the array.
+        """
+        cached = self._inventory_cache.get(self._array_id, 'volume_space') \
+            if self._inventory_cache is not None \
+            else None
+        if ArrayContext.SECTION_SPACE not in self._refresh and cached is not None \
+                and all(name in cached for name in page):
+            return cached
+
+        space = fetch()
+        if self._inventory_cache is not None:
+            # the pages of all the chunks of the array go to the same dict
+            if cached is None:
+                cached = {}
+                self._inventory_cache.put(self._array_id, 'volume_space', cached)
+            cached.update(space)
+        return space
+
+    def _prune_volume_space(self, inventory):
+        # forget the space usage of the volumes deleted since the last inventory
+        cached = self._inventory_cache.get(self._array_id, 'volume_space') \
+            if self._inventory_cache is not None \
+            else None
+        if cached:
+            names = set(name for name, serial in inventory)
+            for name in [n for n in cached if n not in names]:
+                del cached[name]
+
+    def _volume_pages(self, inventory, kwargs):
+        """
+        Fetch the perf, space and serial info of the volumes, one page at a time.
+        :param inventory: list of (name, serial) of the volumes.
+        :param kwargs: The arguments selecting all the volumes of the inventory, if they can be fetched at once.
+        :return: generator of lists of volume documents.
+        """
+        serials = dict(inventory)
+        page_size = self._volume_page_size
+        for i in range(0, len(inventory), page_size):
+            page = [name for name, serial in inventory[i:i + page_size]]
+
+            if self._collection_mode == ArrayContext.COLLECTION_MODE_PER_VOLUME:
+                # get space stats and real-time perf stats per volume
+                space = self._volumes_space(
+                    page, lambda: dict((name, self._ps_client.get_volume(name, space=True)) for name in page))
+                volumes = []
+                for name in page:
+                    vp = self._ps_client.get_volume(name, action='monitor')[0]
+                    vp.update(space[name])
+                    volumes.append(vp)
+            else:
+                # the REST API has no paging, so the pages are selected by names, unless there is only one
+                page_kwargs = kwargs if len(inventory) <= page_size else {'names': ','.join(page)}
+                space = self._volumes_space(
+                    page, lambda: dict((v['name'], v) for v in self._ps_client.list_volumes(space=True, **page_kwargs)))
+                volumes = []
+                for vp in self._ps_client.list_volumes(action='monitor', **page_kwargs):
+                    # skip volumes created or destroyed between the calls
+                    if vp['name'] in space and vp['name'] in serials:
+                        vp.update(space[vp['name']])
+                        volumes.append(vp)
+
+            for vp in volumes:
+                # get the serial number for this volume to use as a unique global id
+                vp['serial'] = serials[vp['name']]
+            yield volumes
+
+    def _enrich_volumes(self, page):
+        topology = self._topology.get()
+        for v in page:
+            v['host_name'] = names_string(topology.volume_hosts(v['name']))
+            v['hgroup_name'] = names_string(topology.volume_hgroups(v['name']))
+            v['array_name'] = self._array_name
+            v['array_id'] = self._array_id
+            v['vol_name'] = self._array_name + ':' + v['name']
+            v[PureCollector._timeofquery_key] = self._timeofquery_str
+        return page
+
+    @staticmethod
+    def _serialize(page):
+        # each document is dumped into json once, for all the indices it goes to
+        return [(doc, json.dumps(doc)) for doc in page]
+
+    def _index_volumes(self, page, serials):
+        for v, s in page:
+            self._indexer.index(index=self._vols_index, doc_type='volperf', body=s)
 
             # non-timeseries volume docs, uses id to bring es versioning into play, uses serial number as global ID
-            self._es_client.index(index=global_vols_index, doc_type='volperf', body=s, id=vp1['serial'], ttl=self._data_ttl)
-
-        # get list of hosts
-        hl = self._ps_client.list_hosts()
-
-        for h in hl:
-            # get real-time perf stats per host
-            hp = self._ps_client.get_host(h['name'], space=True)
-            hp['array_name'] = self._array_name
-            hp['array_id'] = self._array_id
-            hp['host_name'] = h['name']
-            hp['hgroup_name'] = h['hgroup']
-            # add an array name and a volume name that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-            hp['host_name_a'] = h['name']
-            hp['array_name_a'] = self._array_name
-            hp[PureCollector._timeofquery_key] = timeofquery_str
-
-            # dump total document into json
-            s = json.dumps(hp)
-            self._es_client.index(index=hosts_index, doc_type='hostdoc', body=s, ttl=self._data_ttl)
-
-        # get list of host groups
-        hl = self._ps_client.list_hgroups()
-
-        for hg in hl:
+            self._index_global(self._global_vols_index, 'volperf', v['serial'], v, s)
+            serials.append(v['serial'])
+
+    def _index_global(self, index, doc_type, doc_id, doc, body):
+        """
+        Index a non-timeseries document, unless its relevant fields are unchanged since it was last written.
+        """
+        if self._change_cache is None or self._change_cache.should_write(self._array_id, index, doc_id, doc):
+            self._indexer.index(index=index, doc_type=doc_type, body=body, id=doc_id)
+
+    def _collect_hosts(self):
+        topology = self._topology.get()
+        hosts = topology.hosts
+        page_size = self._volume_page_size
+        pages = (hosts[i:i + page_size] for i in range(0, len(hosts), page_size))
+
+        self._pipeline.run(
+            pages,
+            lambda page: [self._host_doc(h, topology) for h in page],
+            self._serialize,
+            self._index_hosts)
+
+    def _host_doc(self, h, topology):
+        # get real-time perf stats per host
+        hp = self._ps_client.get_host(h, space=True)
+        hp['array_name'] = self._array_name
+        hp['array_id'] = self._array_id
+        hp['host_name'] = h
+        hp['hgroup_name'] = topology.host_hgroup(h)
+        hp[PureCollector._timeofquery_key] = self._timeofquery_str
+        return hp
+
+    def _index_hosts(self, page):
+        for hp, s in page:
+            self._indexer.index(index=self._hosts_index, doc_type='hostdoc', body=s)
+
+    def _collect_hgroups(self):
+        topology = self._topology.get()
+
+        for hg in topology.hgroups:
             # get real-time perf stats per host group
-            hgp = self._ps_client.get_hgroup(hg['name'], space=True)
+            hgp = self._ps_client.get_hgroup(hg, space=True)
             hgp['array_name'] = self._array_name
             hgp['array_id'] = self._array_id
-            hgp['hgroup_name'] = hg['name']
-            # add an array name and a volume name that elasticsearch can tokenize ( i.e. won't be present in mappings above )
-            hgp['hgroup_name_a'] = hg['name']
-            hgp['array_name_a'] = self._array_name
-            hgp[PureCollector._timeofquery_key] = timeofquery_str
-
-            # include a reference to all hosts in the group at the time of this call
-            hgl = self._ps_client.get_hgroup(hg['name'])
-            hls = ""
-            for h in hgl['hosts']:
-                hls += h
-                hls += ' '
-            hgp['host_name'] = hls
-
-           # dump total document into json
+            hgp['hgroup_name'] = hg
+            hgp[PureCollector._timeofquery_key] = self._timeofquery_str
+
+            # include a reference to all hosts in the group at the time of the snapshot
+            hgp['host_name'] = names_string(topology.hgroup_hosts(hg))
+
+            # dump total document into json
             s = json.dumps(hgp)
-            self._es_client.index(index=hgroups_index, doc_type='hgroupdoc', body=s, ttl=self._data_ttl)
+            self._indexer.index(index=self._hgroups_index, doc_type='hgroupdoc', body=s)
@@ -0,0 +1,136 @@
+import datetime
+import re
+
+from celery.utils.log import get_task_logger
+from elasticsearch import helpers
+
+logger = get_task_logger(__name__)
+
+# TTL group of the indices of the arrays without data retention.
+NO_RETENTION = "keep"
+
+# Seconds of each time unit of the elasticsearch spec used by data_ttl, e.g. "90d".
+TTL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+TTL_PATTERN = re.compile(r"^(\d+)([smhdw])$")
+
+# Daily indices, e.g. pureelk-vols-90d-2016-01-31, and the ones named before the TTL groups.
+GROUPED_INDEX_PATTERN = re.compile(r"^pureelk-[a-z-]+?-(\d+[smhdw]|" + NO_RETENTION + r")-(\d{4}-\d{2}-\d{2})$")
+# Rollup indices, e.g. pureelk-rollup-hourly-vols-90d-2016-01-31, in the TTL group of their raw index.
+ROLLUP_INDEX_PATTERN = re.compile(
+    r"^pureelk-rollup-[a-z]+-[a-z]+-(\d+[smhdw]|" + NO_RETENTION + r")-(\d{4}-\d{2}-\d{2})$")
+LEGACY_INDEX_PATTERN = re.compile(r"^pureelk-[a-z]+-(\d{4}-\d{2}-\d{2})$")
+
+GLOBAL_INDICES = "pureelk-global-*"
+
+
+def ttl_group(data_ttl):
+    """
+    The TTL group of the daily indices of an array, part of their names.
+    :param data_ttl: The data_ttl of the array, e.g. "90d", None for no retention.
+    """
+    if data_ttl is None:
+        return NO_RETENTION
+
+    group = str(data_ttl).strip().lower()
+    if ttl_seconds(group) is None:
+        logger.warn("Invalid data_ttl '{}', data is kept forever".format(data_ttl))
+        return NO_RETENTION
+    return group
+
+
+def ttl_seconds(group):
+    """
+    :return: The TTL of a group in seconds, None if its data is kept forever.
+    """
+    match = TTL_PATTERN.match(group)
+    return int(match.group(1)) * TTL_UNITS[match.group(2)] if match else None
+
+
+class RetentionSweeper(object):
+    """
+    Deletes the data older than the data_ttl of its array, replacing the per-document _ttl.
+    The daily indices are deleted whole once their last day is older than the TTL of their
+    group. The global indices are not daily, their documents are deleted by age.
+    The rollup indices summarize the raw samples for longer than their TTL group, they have their own TTL.
+    """
+    DEFAULT_ROLLUP_TTL = 365 * 86400  # In seconds
+
+    def __init__(self, es_client, rollup_ttl=DEFAULT_ROLLUP_TTL):
+        """
+        :param rollup_ttl: TTL of the rollup indices in seconds, None to keep them. The rollups of a TTL group
+                           longer than that are kept as long as the group.
+        """
+        self._es_client = es_client
+        self._rollup_ttl = rollup_ttl
+
+    def sweep(self, array_contexts):
+        """
+        :param array_contexts: The arrays currently configured.
+        """
+        now = datetime.datetime.utcnow()
+        ttls = [ttl_seconds(ttl_group(a.data_ttl)) for a in array_contexts]
+
+        # Documents of the arrays removed from the config expire with the longest TTL,
+        # unless some array keeps its data forever.
+        default_ttl = max(ttls) if ttls and None not in ttls else None
+
+        self.sweep_indices(now, default_ttl)
+        self.sweep_global(now, array_contexts, default_ttl)
+
+    def sweep_indices(self, now, legacy_ttl=None):
+        """
+        Delete the daily indices whose last day is older than their TTL.
+        :param legacy_ttl: TTL of the indices named before the TTL groups, None to keep them.
+        """
+        expired = []
+        for index in sorted(self._es_client.indices.get_settings(index="pureelk-*")):
+            rollup = ROLLUP_INDEX_PATTERN.match(index)
+            grouped = GROUPED_INDEX_PATTERN.match(index)
+            legacy = LEGACY_INDEX_PATTERN.match(index)
+            if rollup:
+                ttl, date_str = ttl_seconds(rollup.group(1)), rollup.group(2)
+                if ttl is not None:
+                    ttl = max(ttl, self._rollup_ttl) if self._rollup_ttl is not None else None
+            elif grouped:
+                ttl, date_str = ttl_seconds(grouped.group(1)), grouped.group(2)
+            elif legacy:
+                ttl, date_str = legacy_ttl, legacy.group(1)
+            else:
+                continue
+
+            end_of_day = datetime.datetime.strptime(date_str, "%Y-%m-%d") + datetime.timedelta(days=1)
+            if ttl is not None and end_of_day + datetime.timedelta(seconds=ttl) <= now:
+                expired.append(index)
+
+        if expired:
+            logger.info("Deleting expired indices {}".format(expired))
+            self._es_client.indices.delete(index=",".join(expired), ignore=[404])
+
+    def sweep_global(self, now, array_contexts, default_ttl=None):
+        """
+        Delete the global documents not collected again within the TTL of their array,
+        e.g. of the volumes deleted since. Without delete-by-query they are scanned and bulk deleted.
+        """
+        arrays_by_ttl = {}
+        for a in array_contexts:
+            ttl = ttl_seconds(ttl_group(a.data_ttl))
+            if ttl is not None:
+                arrays_by_ttl.setdefault(ttl, []).append(a.id)
+
+        filters = [{"terms": {"array_id": ids}} for ttl, ids in arrays_by_ttl.items()]
+        cutoffs = list(arrays_by_ttl)
+        if default_ttl is not None:
+            filters.append({"bool": {"must_not": {"terms": {"array_id": [a.id for a in array_contexts]}}}})
+            cutoffs.append(default_ttl)
+
+        for array_filter, ttl in zip(filters, cutoffs):
+            cutoff = (now - datetime.timedelta(seconds=ttl)).isoformat()
+            query = {"query": {"bool": {"filter": [array_filter, {"range": {"timeofquery": {"lt": cutoff}}}]}}}
+            hits = helpers.scan(self._es_client, index=GLOBAL_INDICES, query=query, _source=False,
+                                ignore_unavailable=True)
+            deleted, errors = helpers.bulk(
+                self._es_client,
+                ({"_op_type": "delete", "_index": h["_index"], "_type": h["_type"], "_id": h["_id"]} for h in hits),
+                raise_on_error=False)
+            if deleted or errors:
+                logger.info("Deleted {} expired global documents, {} failed".format(deleted, len(errors)))
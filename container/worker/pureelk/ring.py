@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    """
+    Consistent-hash ring of the worker nodes. Each node has many points on the ring and a key
+    belongs to the node of the first point after the hash of the key, so a node joining or
+    leaving only moves the keys next to its own points, about 1/N of them.
+    """
+    DEFAULT_REPLICAS = 100  # Points of each node on the ring
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        points = sorted((_hash("{}#{}".format(node, i)), node) for node in set(nodes) for i in range(replicas))
+        self._hashes = [h for h, node in points]
+        self._nodes = [node for h, node in points]
+
+    @property
+    def nodes(self):
+        return sorted(set(self._nodes))
+
+    def owner(self, key):
+        """
+        :return: The node owning the key, None if the ring is empty.
+        """
+        if not self._nodes:
+            return None
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
@@ -0,0 +1,161 @@
+import datetime
+import re
+
+from celery.utils.log import get_task_logger
+
+from .retention import NO_RETENTION
+
+logger = get_task_logger(__name__)
+
+# Rolled up raw indices, e.g. pureelk-vols-90d-2016-01-31
+RAW_INDEX_PATTERN = re.compile(r"^pureelk-(vols|hosts|arrays)-(\d+[smhdw]|" + NO_RETENTION + r")-(\d{4}-\d{2}-\d{2})$")
+
+# Field identifying the object of each document in the raw indices, besides array_id.
+# Array documents only have array_id.
+KEY_FIELDS = {
+    "vols": "vol_name",
+    "hosts": "host_name",
+    "arrays": None
+}
+
+# Fields summarized in the rollups: latency, IOPS and bandwidth. Hosts only have space stats.
+PERF_FIELDS = ["usec_per_read_op", "usec_per_write_op", "reads_per_sec", "writes_per_sec",
+               "input_per_sec", "output_per_sec"]
+ROLLUP_FIELDS = {
+    "vols": PERF_FIELDS,
+    "hosts": ["total", "volumes", "snapshots", "data_reduction"],
+    "arrays": PERF_FIELDS + ["queue_depth"]
+}
+
+HOURLY = "hourly"
+DAILY = "daily"
+
+# Marks the raw indices completely rolled up, stored in their daily rollup index.
+DONE_TYPE = "rollupdone"
+
+
+def rollup_index(interval, kind, group, date_str):
+    """
+    Rollup indices keep the TTL group of their raw index. The retention sweep keeps them at least as long.
+    """
+    return "pureelk-rollup-{}-{}-{}-{}".format(interval, kind, group, date_str)
+
+
+class Rollup(object):
+    """
+    Aggregates the raw samples of the daily vols, hosts and arrays indices older than a given age
+    into hourly and daily summaries with the min, max, average and 95th percentile of each field.
+    Once rolled up, the raw indices can be deleted before the TTL of their arrays.
+    """
+    DEFAULT_AGE = 86400  # In seconds, after the end of the day of the raw index
+    DEFAULT_RAW_TTL = 30 * 86400  # In seconds, after the end of the day of the raw index
+
+    def __init__(self, es_client, make_indexer, prepare_indices, age=DEFAULT_AGE, raw_ttl=DEFAULT_RAW_TTL):
+        """
+        :param es_client: The Elasticsearch client.
+        :param make_indexer: Function returning a BulkIndexer, used to write the rollup documents.
+        :param prepare_indices: Function creating a list of indices, their mapping comes from the index templates.
+        :param age: Seconds after the end of their day the raw indices are rolled up.
+        :param raw_ttl: Seconds after the end of their day the rolled up raw indices are deleted, None to keep them.
+        """
+        self._es_client = es_client
+        self._make_indexer = make_indexer
+        self._prepare_indices = prepare_indices
+        self._age = age
+        self._raw_ttl = raw_ttl
+
+    def run(self):
+        now = datetime.datetime.utcnow()
+        raw_indices = self._es_client.indices.get_settings(index="pureelk-vols-*,pureelk-hosts-*,pureelk-arrays-*")
+        for index in sorted(raw_indices):
+            match = RAW_INDEX_PATTERN.match(index)
+            if not match:
+                continue
+
+            kind, group, date_str = match.groups()
+            end_of_day = datetime.datetime.strptime(date_str, "%Y-%m-%d") + datetime.timedelta(days=1)
+            if end_of_day + datetime.timedelta(seconds=self._age) > now:
+                continue
+
+            daily_index = rollup_index(DAILY, kind, group, date_str)
+            if not self._es_client.exists(index=daily_index, doc_type=DONE_TYPE, id=index, ignore=[404]):
+                self.rollup(index, kind, group, date_str)
+            elif self._raw_ttl is not None and end_of_day + datetime.timedelta(seconds=self._raw_ttl) <= now:
+                # Unlike the retention sweep, this is shorter than the TTL of the group.
+                logger.info("Deleting raw index {}, it is rolled up".format(index))
+                self._es_client.indices.delete(index=index, ignore=[404])
+
+    def rollup(self, index, kind, group, date_str):
+        """
+        Roll up one raw daily index into its hourly and daily rollup indices.
+        """
+        logger.info("Rolling up index {}".format(index))
+        hourly_index = rollup_index(HOURLY, kind, group, date_str)
+        daily_index = rollup_index(DAILY, kind, group, date_str)
+        self._prepare_indices([hourly_index, daily_index])
+
+        day = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+        indexer = self._make_indexer()
+
+        # One query per hour, the number of buckets of a whole day of volumes is too large.
+        for hour in range(24):
+            start = day + datetime.timedelta(hours=hour)
+            self._rollup_range(indexer, index, kind, hourly_index, HOURLY, start, start + datetime.timedelta(hours=1))
+        # The daily percentiles can't be computed from the hourly ones.
+        self._rollup_range(indexer, index, kind, daily_index, DAILY, day, day + datetime.timedelta(days=1))
+
+        indexer.flush()
+        if indexer.failed:
+            logger.error("Failed to roll up {} documents of index {}".format(indexer.failed, index))
+            return
+
+        # Only marked done once all the documents are written, otherwise it is rolled up again next time.
+        # The documents have fixed ids, so rolling up again replaces them.
+        self._es_client.index(index=daily_index, doc_type=DONE_TYPE, id=index, body={"index": index})
+
+    def _rollup_range(self, indexer, index, kind, target_index, interval, start, end):
+        fields = ROLLUP_FIELDS[kind]
+        key_field = KEY_FIELDS[kind]
+
+        stats = {}
+        for f in fields:
+            stats[f] = {"stats": {"field": f}}
+            stats[f + "_p95"] = {"percentiles": {"field": f, "percents": [95]}}
+
+        # terms size 0 returns all the buckets on ES 2.x
+        array_aggs = {"array_name": {"terms": {"field": "array_name", "size": 1}}}
+        if key_field:
+            array_aggs["objects"] = {"terms": {"field": key_field, "size": 0}, "aggs": stats}
+        else:
+            array_aggs.update(stats)
+
+        body = {
+            "size": 0,
+            "query": {"range": {"timeofquery": {"gte": start.isoformat(), "lt": end.isoformat()}}},
+            "aggs": {"arrays": {"terms": {"field": "array_id", "size": 0}, "aggs": array_aggs}}
+        }
+        result = self._es_client.search(index=index, body=body)
+
+        for array_bucket in result["aggregations"]["arrays"]["buckets"]:
+            names = array_bucket["array_name"]["buckets"]
+            base = {
+                "array_id": array_bucket["key"],
+                "array_name": names[0]["key"] if names else None,
+                "interval": interval,
+                "timeofquery": start.isoformat()
+            }
+            objects = array_bucket["objects"]["buckets"] if key_field else [array_bucket]
+            for bucket in objects:
+                doc = dict(base)
+                doc_id = [base["array_id"]]
+                if key_field:
+                    doc[key_field] = bucket["key"]
+                    doc_id.append(bucket["key"])
+                doc["samples"] = bucket["doc_count"]
+                for f in fields:
+                    doc[f + "_min"] = bucket[f]["min"]
+                    doc[f + "_max"] = bucket[f]["max"]
+                    doc[f + "_avg"] = bucket[f]["avg"]
+                    doc[f + "_p95"] = list(bucket[f + "_p95"]["values"].values())[0]
+                doc_id.append(start.strftime("%Y-%m-%dT%H"))
+                indexer.index(index=target_index, doc_type="rollup", body=doc, id=":".join(doc_id))
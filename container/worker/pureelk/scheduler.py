@@ -0,0 +1,66 @@
+import hashlib
+import heapq
+import math
+
+
+class DeadlineScheduler(object):
+    """
+    Priority queue of the next collection deadline of each array.
+    Deadlines are aligned to a per-array phase derived from the array id, so that
+    arrays sharing a frequency are spread evenly over the interval instead of all
+    being collected at the same moment.
+    """
+
+    def __init__(self):
+        # Heap of (deadline, array id). Entries no longer matching self._deadlines are stale
+        # and are dropped when they reach the top.
+        self._heap = []
+        # array id -> (deadline, frequency)
+        self._deadlines = {}
+
+    @staticmethod
+    def phase(array_id, frequency):
+        """
+        Deterministic offset of an array within its frequency interval, in seconds.
+        """
+        digest = hashlib.md5(array_id.encode("utf-8")).hexdigest()
+        return (int(digest[:8], 16) % (frequency * 1000)) / 1000.0
+
+    @staticmethod
+    def next_deadline(array_id, frequency, not_before):
+        """
+        The first time slot of the array at or after not_before.
+        """
+        phase = DeadlineScheduler.phase(array_id, frequency)
+        # Rounded first, so that a not_before already on a slot, e.g. the last deadline plus the frequency,
+        # doesn't skip to the next one by a float error.
+        return math.ceil(round((not_before - phase) / float(frequency), 6)) * frequency + phase
+
+    def push(self, array_id, deadline, frequency):
+        """
+        Set the next deadline of an array, replacing any previous one.
+        """
+        self._deadlines[array_id] = (deadline, frequency)
+        heapq.heappush(self._heap, (deadline, array_id))
+
+    def remove(self, array_id):
+        self._deadlines.pop(array_id, None)
+
+    def frequency(self, array_id):
+        """
+        :return: The frequency the array was scheduled with, None if it is not scheduled.
+        """
+        return self._deadlines[array_id][1] if array_id in self._deadlines else None
+
+    def pop_due(self, until):
+        """
+        Remove and return the arrays due by the given time, earliest first.
+        :return: list of (array id, deadline).
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= until:
+            deadline, array_id = heapq.heappop(self._heap)
+            if array_id in self._deadlines and self._deadlines[array_id][0] == deadline:
+                del self._deadlines[array_id]
+                due.append((array_id, deadline))
+        return due
@@ -0,0 +1,256 @@
+import json
+import os
+import time
+
+import gevent
+from celery.utils.log import get_task_logger
+from elasticsearch.exceptions import TransportError
+
+from .bulkindexer import is_retryable
+
+logger = get_task_logger(__name__)
+
+
+class Spool(object):
+    """
+    Bounded on-disk spool of the bulk batches that couldn't be sent to Elasticsearch.
+    Each batch is written as a segment file holding the lines of its _bulk request,
+    named so that the segments sort oldest first. When the spool grows over its size
+    cap, the oldest segments are evicted.
+    The folder is shared by all the worker processes of the host. A drainer claims a
+    segment by renaming it before replaying it, so no two drainers replay the same one.
+    """
+    DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    SEGMENT_SUFFIX = ".bulk"
+    CLAIMED_SUFFIX = ".claimed"
+    TMP_SUFFIX = ".tmp"
+
+    # In seconds. A segment claimed longer ago is released, e.g. the process replaying it died.
+    CLAIM_TIMEOUT = 600
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._seq = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # The segments are listed again whenever the folder changes, e.g. by another process.
+        # Folder mtime and the segment names found at the last listing, with their sizes.
+        self._dir_mtime = None
+        self._segments = []
+        self._sizes = {}
+
+    @property
+    def pending(self):
+        """
+        Number of segments waiting to be replayed, left over by a previous run included.
+        """
+        self._list()
+        return len(self._segments)
+
+    def append(self, actions):
+        """
+        Write a batch of actions as a new segment.
+        :param actions: list of (action line, source line).
+        """
+        self._seq += 1
+        name = "{:017.6f}-{}-{:08d}{}".format(time.time(), os.getpid(), self._seq, Spool.SEGMENT_SUFFIX)
+        self._write(name, actions)
+        self._evict()
+
+    def claim(self):
+        """
+        Claim the oldest segment, unless another drainer claimed it first.
+        :return: (claimed segment name, list of (action line, source line)), None if the spool is empty.
+        """
+        self._release_expired()
+        self._list()
+        for name in list(self._segments):
+            claimed = name + Spool.CLAIMED_SUFFIX
+            try:
+                # Atomic, only one of the drainers renaming the segment at the same time succeeds.
+                os.rename(self._segment_path(name), self._segment_path(claimed))
+            except OSError:
+                continue
+            self._changed()
+
+            try:
+                # The claim expires from now.
+                os.utime(self._segment_path(claimed), None)
+                with open(self._segment_path(claimed)) as segment_file:
+                    lines = segment_file.read().splitlines()
+                return claimed, list(zip(lines[0::2], lines[1::2]))
+            except (IOError, OSError) as e:
+                logger.warn("Dropping unreadable spool segment {}: {}".format(name, e))
+                self.remove(claimed)
+
+        return None
+
+    def release(self, claimed, actions):
+        """
+        Give back the actions of a claimed segment that couldn't be replayed yet. They keep the place of the segment.
+        :param claimed: The claimed segment name, as returned by claim().
+        :param actions: list of (action line, source line).
+        """
+        self._write(claimed[:-len(Spool.CLAIMED_SUFFIX)], actions)
+        self.remove(claimed)
+
+    def remove(self, name):
+        try:
+            os.remove(self._segment_path(name))
+        except OSError as e:
+            logger.warn("Error when removing spool segment {}: {}".format(name, e))
+        self._changed()
+
+    def _write(self, name, actions):
+        # Write under a temporary name, so the drainers never read a partial segment.
+        path = self._segment_path(name)
+        with open(path + Spool.TMP_SUFFIX, "w") as segment_file:
+            for action in actions:
+                segment_file.write(action[0] + "\n" + action[1] + "\n")
+        os.rename(path + Spool.TMP_SUFFIX, path)
+        self._changed()
+
+    def _list(self):
+        # The folder mtime changes when segments are added, claimed or removed.
+        dir_mtime = os.stat(self._path).st_mtime
+        if dir_mtime == self._dir_mtime:
+            return
+
+        self._segments = sorted(f for f in os.listdir(self._path) if f.endswith(Spool.SEGMENT_SUFFIX))
+        self._sizes = dict((name, self._sizes[name] if name in self._sizes else self._size_of(name))
+                           for name in self._segments)
+        self._dir_mtime = dir_mtime
+
+    def _changed(self):
+        # Changes made within the same mtime tick as the last listing would go unnoticed.
+        self._dir_mtime = None
+
+    def _release_expired(self):
+        now = time.time()
+        for claimed in [f for f in os.listdir(self._path) if f.endswith(Spool.CLAIMED_SUFFIX)]:
+            try:
+                if os.path.getmtime(self._segment_path(claimed)) + Spool.CLAIM_TIMEOUT > now:
+                    continue
+                logger.warn("Releasing spool segment {}, claimed {} seconds ago".format(claimed, Spool.CLAIM_TIMEOUT))
+                os.rename(self._segment_path(claimed), self._segment_path(claimed[:-len(Spool.CLAIMED_SUFFIX)]))
+                self._changed()
+            except OSError:
+                # e.g. removed by its drainer meanwhile
+                pass
+
+    def _segment_path(self, name):
+        return os.path.join(self._path, name)
+
+    def _size_of(self, name):
+        try:
+            return os.path.getsize(self._segment_path(name))
+        except OSError:
+            return 0
+
+    def _evict(self):
+        # Always keep the newest segment, even if it is over the cap on its own.
+        self._list()
+        while len(self._segments) > 1 and sum(self._sizes.values()) > self._max_bytes:
+            name = self._segments.pop(0)
+            self._sizes.pop(name)
+            logger.warn("Spool is over {} bytes, evicting the oldest segment {}".format(self._max_bytes, name))
+            self.remove(name)
+
+
+class _Remainder(object):
+    """
+    Stands for the spool of the indexer replaying a segment, and keeps the actions it couldn't send.
+    Once it holds some, the indexer gives it the following batches too, so they keep their order.
+    """
+
+    def __init__(self):
+        self.actions = []
+
+    @property
+    def pending(self):
+        return len(self.actions)
+
+    def append(self, actions):
+        self.actions.extend(actions)
+
+
+class SpoolDrainer(object):
+    """
+    Background greenlet replaying the spooled batches into Elasticsearch, oldest first,
+    once it is reachable again.
+    """
+    DEFAULT_INTERVAL = 10  # In seconds
+
+    def __init__(self, spool, make_indexer, prepare_indices=None, interval=DEFAULT_INTERVAL):
+        """
+        :param spool: The spool to drain.
+        :param make_indexer: Function(spool) returning a BulkIndexer spooling to the given spool, used to replay
+                             a segment. It gets a stand-in spool keeping the actions to give back to the segment.
+        :param prepare_indices: Optional function called with the index names of a segment before it is replayed.
+        :param interval: Seconds to wait when the spool is empty or Elasticsearch is unavailable.
+        """
+        self._spool = spool
+        self._make_indexer = make_indexer
+        self._prepare_indices = prepare_indices
+        self._interval = interval
+        self._greenlet = None
+
+    def start(self):
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            if not self.drain():
+                gevent.sleep(self._interval)
+
+    def drain(self):
+        """
+        Replay the oldest segment.
+        :return: True if a segment was replayed, False if the spool is empty or Elasticsearch is still unavailable.
+        """
+        segment = self._spool.claim()
+        if segment is None:
+            return False
+
+        name, actions = segment
+        remainder = _Remainder()
+        try:
+            if self._prepare_indices:
+                self._prepare_indices(set(_index_of(action) for action in actions))
+
+            indexer = self._make_indexer(remainder)
+            for action in actions:
+                indexer.index_action(action)
+            indexer.flush()
+        except TransportError as e:
+            if is_retryable(e):
+                # Nothing was sent yet.
+                logger.info("Elasticsearch still unavailable, {} spool segments pending: {}".format(
+                    self._spool.pending + 1, e))
+                self._spool.release(name, actions)
+                return False
+
+            # The segment would fail the same way forever, don't let it block the ones after it.
+            logger.error("Dropping spool segment {} rejected by Elasticsearch: {}".format(name, e))
+            self._spool.remove(name)
+            return True
+
+        if remainder.actions:
+            # Only the documents not indexed yet are replayed again, the time-series documents have no ids.
+            logger.info("Elasticsearch unavailable again, {} of the {} documents of spool segment {} left".format(
+                len(remainder.actions), len(actions), name))
+            self._spool.release(name, remainder.actions)
+            return False
+
+        logger.info("Replayed spool segment {} with {} documents, {} failed".format(name, indexer.indexed, indexer.failed))
+        self._spool.remove(name)
+        return True
+
+
+def _index_of(action):
+    meta = json.loads(action[0])
+    return list(meta.values())[0]["_index"]
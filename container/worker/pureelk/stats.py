@@ -0,0 +1,112 @@
+"""
+    Live collection stats, published by the collection worker on a fanout exchange of the
+    broker and kept in memory by the web server, so neither side reads or writes files for them.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from kombu import Connection, Exchange, Queue
+
+# Transient and not durable: the stats are only useful to the listeners currently connected.
+STATS_EXCHANGE = Exchange("pureelk.stats", type="fanout", durable=False,
+                          delivery_mode=Exchange.TRANSIENT_DELIVERY_MODE)
+
+# The queue of the collection tasks, whose depth tells how far behind the collection worker is.
+ARRAY_TASKS_QUEUE = "array_tasks"
+
+
+def publish_stats(app, stats):
+    """
+    Publish the stats of a collection.
+    :param app: The celery app, whose producer pool is used.
+    :param stats: The stats as a json object, with at least the array id.
+    """
+    with app.producer_or_acquire() as producer:
+        producer.publish(stats, exchange=STATS_EXCHANGE, routing_key="", serializer="json",
+                         declare=[STATS_EXCHANGE])
+
+
+class StatsListener(object):
+    """
+    Background thread keeping the latest stats published for each array, and the number of
+    collection tasks waiting in the array_tasks queue.
+    """
+    DEFAULT_DEPTH_INTERVAL = 5  # In seconds
+    RECONNECT_INTERVAL = 5  # In seconds
+
+    def __init__(self, broker_url, logger=None, depth_interval=DEFAULT_DEPTH_INTERVAL):
+        self._broker_url = broker_url
+        self._logger = logger or logging.getLogger(__name__)
+        self._depth_interval = depth_interval
+        self._latest = {}
+        self._queue_depth = None
+        self._depth_time = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stats-listener")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def get(self, array_id):
+        """
+        :return: The latest stats of an array, None if none were received since the listener started.
+        """
+        return self._latest.get(array_id)
+
+    @property
+    def queue_depth(self):
+        """
+        Number of collection tasks waiting in the array_tasks queue, None if unknown.
+        """
+        return self._queue_depth
+
+    def _run(self):
+        while True:
+            try:
+                self._consume()
+            except Exception as e:
+                self._logger.warn("Stats listener disconnected from {}: {}".format(self._broker_url, e))
+                self._queue_depth = None
+            time.sleep(StatsListener.RECONNECT_INTERVAL)
+
+    def _consume(self):
+        # An exclusive queue of our own, bound to the fanout exchange, deleted when we disconnect.
+        queue = Queue("pureelk.stats.{}.{}".format(socket.gethostname(), os.getpid()),
+                      exchange=STATS_EXCHANGE, durable=False, exclusive=True)
+
+        with Connection(self._broker_url) as connection:
+            with connection.Consumer(queue, callbacks=[self._on_stats], accept=["json"]):
+                while True:
+                    try:
+                        connection.drain_events(timeout=self._depth_interval)
+                    except socket.timeout:
+                        pass
+
+                    if time.time() - self._depth_time >= self._depth_interval:
+                        self._update_queue_depth(connection)
+
+    def _update_queue_depth(self, connection):
+        # A passive declare only returns the message count, it never creates the queue.
+        # It fails if the collection worker never created it, and closes the channel, so it has its own.
+        channel = connection.channel()
+        try:
+            self._queue_depth = channel.queue_declare(queue=ARRAY_TASKS_QUEUE, passive=True)[1]
+        except Exception as e:
+            self._logger.info("Queue {} not available: {}".format(ARRAY_TASKS_QUEUE, e))
+            self._queue_depth = None
+        finally:
+            self._depth_time = time.time()
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def _on_stats(self, body, message):
+        if "array_id" in body:
+            self._latest[body["array_id"]] = body
+        message.ack()
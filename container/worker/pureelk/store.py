@@ -5,32 +5,50 @@ import urllib
 from pureelk.arraycontext import ArrayContext
 
 STATE_FILE = ".pureelk.arrays.state"
+# State file of each worker node, with the arrays it schedules.
+NODE_STATE_FILE = ".pureelk.arrays.{}.state"
+WATERMARKS_FILE = ".pureelk.{}.watermarks"
 
 class Store(object):
 
-    def __init__(self, path, logger):
+    def __init__(self, path, logger, node_id=None):
         """
         Store class for saving and loading of states
         The current implementation is file-based since the data set is tiny
         Each array's config is stored in its own .json file. The worker also
         write the current task state into a .pureelk.state file each time it runs.
+        With several worker nodes, each one writes its own state file and the states of all of them are merged.
         :param path: The path of the folder containing all the configs
+        :param node_id: The worker node writing the state, None for a single node.
         :return: dictionary of arrays, index by array id.
         """
         self._path = path
         self._logger = logger
+        self._state_file = NODE_STATE_FILE.format(node_id) if node_id else STATE_FILE
+
+        # The store only re-parses the files that changed since the last load.
+        # Directory mtime, json and state file names found at the last listing.
+        self._dir_mtime = None
+        self._file_names = []
+        self._state_names = []
+        # file name -> (mtime, size, config json) of the parsed configs.
+        self._configs = {}
+        # state file name -> ((mtime, size), parsed content) of the state files.
+        self._states = {}
+        # The state last written by this store.
+        self._saved_state = None
 
     def load_arrays(self):
         arrays = {}
 
         # Load all the json configs for the arrays.
-        for file_name in os.listdir(self._path):
-            if file_name.endswith(".json"):
-                try:
-                    array = self._load_config_one(file_name)
-                    arrays[array.id] = array
-                except Exception as e:
-                    self._logger.warn("Exception at loading config {}: {}".format(file_name, e))
+        for file_name, config_json in self._load_configs():
+            array = ArrayContext()
+            array.update_config_json(config_json)
+            # TODO: We use file name as id if it is not present in the JSON.
+            if not array.id:
+                array.id = urllib.quote(os.path.splitext(file_name)[0])
+            arrays[array.id] = array
 
         try:
             # Load the arrays execution state and merge them in.
@@ -43,9 +61,50 @@ class Store(object):
 
         return arrays
 
+    def signature(self):
+        """
+        A cheap fingerprint of the configs and the state on disk, made of file stats only.
+        It changes whenever load_arrays() could return something different.
+        """
+        self._list_configs()
+        configs = tuple((f, self._stat(os.path.join(self._path, f))) for f in self._file_names)
+        states = tuple((f, self._stat(os.path.join(self._path, f))) for f in self._state_names)
+        return self._dir_mtime, configs, states
+
     def save_array_states(self, arrays):
-        with open(os.path.join(self._path, STATE_FILE), 'w') as state_file:
-            state_file.write(json.dumps([a.get_state_json() for a in arrays]))
+        states = [a.get_state_json() for a in arrays]
+        content = json.dumps(states)
+
+        # Skip the write if no array's state changed since the last save.
+        if content == self._saved_state:
+            return
+
+        path = os.path.join(self._path, self._state_file)
+        with open(path, 'w') as state_file:
+            state_file.write(content)
+
+        self._saved_state = content
+        self._states[self._state_file] = (self._stat(path), states)
+
+    def load_watermarks(self, array_id):
+        """
+        Load the high-water marks of the messages already indexed for an array.
+        :return: dictionary of marks, empty if they were never saved or got lost.
+        """
+        path = self._watermarks_path(array_id)
+        if os.path.exists(path):
+            try:
+                with open(path) as watermarks_file:
+                    return json.load(watermarks_file)
+            except Exception as e:
+                self._logger.warn("Exception at loading watermarks of array '{}': {}".format(array_id, e))
+
+        return {}
+
+    def save_watermarks(self, array_id, watermarks):
+        # Each array has its own file since collections of different arrays run concurrently.
+        with open(self._watermarks_path(array_id), 'w') as watermarks_file:
+            watermarks_file.write(json.dumps(watermarks))
 
     def save_array_config(self, array):
         file_name = os.path.join(self._path, urllib.unquote(array.id) + ".json")
@@ -59,29 +118,109 @@ class Store(object):
         except OSError as error:
             self._logger.warn("Error when removing array '{}': {}".format(id, error))
 
+        # The watermarks might not exist if the array was never collected.
+        try:
+            os.remove(self._watermarks_path(id))
+        except OSError:
+            pass
+
+    def _load_configs(self):
+        """
+        Load the json configs of the arrays, parsing only the files added or modified since the last load.
+        :return: list of (file name, config json).
+        """
+        self._list_configs()
+
+        configs = {}
+        for file_name in self._file_names:
+            stat = self._stat(os.path.join(self._path, file_name))
+            if stat is None:
+                continue
+
+            cached = self._configs.get(file_name)
+            if cached is None or cached[:2] != stat:
+                try:
+                    cached = stat + (self._load_config_one(file_name),)
+                except Exception as e:
+                    self._logger.warn("Exception at loading config {}: {}".format(file_name, e))
+                    continue
+
+            configs[file_name] = cached
+
+        # Configs of deleted files are dropped here.
+        self._configs = configs
+        return [(file_name, cached[2]) for file_name, cached in configs.items()]
+
+    def _list_configs(self):
+        # The directory mtime only changes when files are added, removed or renamed.
+        dir_mtime = os.stat(self._path).st_mtime
+        if dir_mtime != self._dir_mtime:
+            file_names = os.listdir(self._path)
+            self._file_names = [f for f in file_names if f.endswith(".json")]
+            self._state_names = [f for f in file_names if f.startswith(".pureelk.arrays.") and f.endswith(".state")]
+            self._dir_mtime = dir_mtime
+
     def _load_config_one(self, filename):
         path = os.path.join(self._path, filename)
         if os.path.exists(path):
-            array = ArrayContext()
             with open(path) as json_file:
                 json_object = json.load(json_file)
-                array.update_config_json(json_object)
-                # TODO: We use file name as id if it is not present in the JSON.
-                if not array.id:
-                    array.id = urllib.quote(os.path.splitext(filename)[0])
                 self._logger.info("Loaded config = {}".format(json_object))
 
-            return array
+            return json_object
 
         raise ValueError("Array config {} not found".format(filename))
 
-    def _load_state(self):
-        path = os.path.join(self._path, STATE_FILE)
-        state = []
-        self._logger.info("loading state from {}".format(path))
-        if os.path.exists(path):
-            with open(path) as state_file:
-                state = json.load(state_file)
-                self._logger.info("Loaded state = {}".format(state))
+    def _watermarks_path(self, array_id):
+        return os.path.join(self._path, WATERMARKS_FILE.format(urllib.unquote(array_id)))
+
+    @staticmethod
+    def _stat(path):
+        """
+        :return: (mtime, size) of the file, or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
 
-        return state
+    def _load_state(self):
+        """
+        Load the states of all the worker nodes, parsing only the files modified since the last load.
+        :return: list of array states.
+        """
+        self._list_configs()
+
+        states = {}
+        for file_name in self._state_names:
+            path = os.path.join(self._path, file_name)
+            stat = self._stat(path)
+            if stat is None:
+                continue
+
+            cached = self._states.get(file_name)
+            if cached is None or cached[0] != stat:
+                self._logger.info("loading state from {}".format(path))
+                try:
+                    with open(path) as state_file:
+                        cached = (stat, json.load(state_file))
+                        self._logger.info("Loaded state = {}".format(cached[1]))
+                except Exception as e:
+                    # e.g. read while being written, the previous content is kept until the next load.
+                    self._logger.warn("Exception at loading state {}: {}".format(file_name, e))
+                    if cached is None:
+                        continue
+
+            states[file_name] = cached
+        self._states = states
+
+        # An array moved to another node is still in the state file of its old node, the latest collection wins.
+        merged = {}
+        for stat, file_states in states.values():
+            for array_state in file_states:
+                current = merged.get(array_state[ArrayContext.ID])
+                if current is None or array_state[ArrayContext.TASK_TIMESTAMP] > current[ArrayContext.TASK_TIMESTAMP]:
+                    merged[array_state[ArrayContext.ID]] = array_state
+
+        return list(merged.values())
@@ -1,16 +1,64 @@
 from __future__ import absolute_import
 
+import datetime
 import time
 
-import purestorage
-from elasticsearch import Elasticsearch
+import gevent
+from celery import signals
+
 from .worker import app
 from .worker import logger
 from .worker import context
 from .purecollector import PureCollector
+from .bulkindexer import BulkIndexer
+from .indexcache import IndexCache
+from .clientpool import ClientPool
+from .scheduler import DeadlineScheduler
+from .arraycontext import ArrayContext
+from .metrics import CollectionMetrics
+from .spool import Spool, SpoolDrainer
+from .changecache import ChangeCache
+from .inventorycache import InventoryCache
+from .metadatacache import MetadataCache
+from .retention import RetentionSweeper
+from .rollup import Rollup
+from .stats import publish_stats
+from .templates import index_templates, DEFAULT_SHARDS, DEFAULT_REPLICAS, DEFAULT_REFRESH_INTERVAL
+
+TASK_TIMEOUT = ArrayContext.TASK_START_TIMEOUT
+
+# Name of the periodic sweep in CELERYBEAT_SCHEDULE
+ARRAYS_SCHEDULE = "arrays_schedule"
+
+# "elasticsearch" is the internal link to PureELK ES server
+ES_HOSTS = "elasticsearch:9200"
+
+# FlashArray sessions and ES connections reused across the collections of this worker process.
+client_pool = ClientPool(app.conf.get("PUREELK_ES_MAXSIZE", ClientPool.DEFAULT_ES_MAXSIZE),
+                         app.conf.get("PUREELK_SESSION_IDLE_TIMEOUT", ClientPool.DEFAULT_IDLE_TIMEOUT))
+
+# Indices known to exist, shared by all the collections running in this worker process.
+index_cache = IndexCache(
+    app.conf.get("PUREELK_INDEX_REVALIDATE_INTERVAL", IndexCache.DEFAULT_REVALIDATE_INTERVAL),
+    index_templates(app.conf.get("PUREELK_INDEX_SHARDS", DEFAULT_SHARDS),
+                    app.conf.get("PUREELK_INDEX_REPLICAS", DEFAULT_REPLICAS),
+                    app.conf.get("PUREELK_INDEX_REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL)))
 
-SCHEDULE_TOLERANCE = 5
-TASK_TIMEOUT = 300
+# Content hashes of the global documents last written for each array.
+change_cache = ChangeCache(app.conf.get("PUREELK_GLOBAL_REFRESH_INTERVAL", ChangeCache.DEFAULT_REFRESH_INTERVAL))
+
+# Inventory and space usage of each array, reused until their sections are due again.
+inventory_cache = InventoryCache()
+
+# Serials and connections of the volumes, and id and version of the arrays, kept across the inventory refreshes.
+metadata_cache = MetadataCache(
+    app.conf.get("PUREELK_METADATA_TTL", MetadataCache.DEFAULT_TTL),
+    app.conf.get("PUREELK_METADATA_MAX_SIZE", MetadataCache.DEFAULT_MAX_SIZE))
+
+# On-disk spool of the documents that couldn't be indexed, and the greenlet replaying it.
+# Created by the first collection, so that only the collection worker has them.
+spool = None
+spool_drainer = None
 
 @app.task
 def arrays_schedule():
@@ -22,33 +70,306 @@ def arrays_schedule():
     context.prepare()
     now = time.time()
 
-    for array_name, array_context in context.array_contexts.iteritems():
-
+    # Dispatch every collection due before the next sweep, delayed to start exactly at its deadline.
+    for array_id, deadline in context.scheduler.pop_due(now + schedule_interval()):
+        array_context = context.array_contexts[array_id]
+        frequency = array_context.frequency
         last_task_completed = array_context.is_task_completed
 
-        # If the next run's time stamp is within 5 second of now, we'll just run it now,
-        # instead of waiting for the next schedule.
-        is_time_to_run = array_context.task_starttime + array_context.frequency <= now + SCHEDULE_TOLERANCE
+        if array_context.enabled and last_task_completed:
+            countdown = max(0, deadline - now)
+            # The task events of the collection come back to this node.
+            array_context.scheduler_queue = context.scheduler_queue
+            task = array_collect.apply_async(
+                [array_context],
+                {"deadline": deadline},
+                countdown=countdown,
+                expires=countdown + TASK_TIMEOUT)
+            array_context.task_id = task.id
+            array_context.task_state = ArrayContext.TASK_PENDING
+            array_context.task_starttime = deadline
 
-        if array_context.enabled and last_task_completed and is_time_to_run:
-            task = array_collect.apply_async([array_context], expires=TASK_TIMEOUT)
-            array_context.task = task
-            array_context.task_starttime = now
-            logger.info("Scheduled collection for array {} at host {}".format(array_name, array_context.host))
+            # A late collection moves on to the first slot after now, instead of catching up.
+            context.scheduler.push(
+                array_id,
+                DeadlineScheduler.next_deadline(array_id, frequency, max(deadline + frequency, now)),
+                frequency)
+            logger.info("Scheduled collection for array {} at host {} in {:.1f} seconds".format(
+                array_id, array_context.host, countdown))
+        elif not array_context.enabled:
+            context.scheduler.push(array_id, deadline + frequency, frequency)
+            logger.info("Skip array {}, it is disabled".format(array_id))
         else:
-            logger.info("Skip array {}. Enabled = {}, Last task completed = {}, Time to run now = {}".format(
-                array_name, array_context.enabled, last_task_completed, is_time_to_run))
+            # Keep it due so that it is dispatched by the first sweep after the last task completes.
+            context.scheduler.push(array_id, deadline, frequency)
+            logger.info("Skip array {}, last task not completed".format(array_id))
 
 
-@app.task
-def array_collect(array_context):
+@app.task(ignore_result=True)
+def retention_sweep():
+    """
+    Periodic task deleting the data older than the data_ttl of its array.
+    """
+    if not context.is_maintenance_node():
+        return
+    RetentionSweeper(client_pool.get_elasticsearch(ES_HOSTS),
+                     app.conf.get("PUREELK_ROLLUP_TTL", RetentionSweeper.DEFAULT_ROLLUP_TTL)).sweep(
+        context.array_contexts.values())
+
+
+@app.task(ignore_result=True)
+def schedule_rollup():
+    """
+    Periodic task sending the rollup to the collection workers, from a single node.
+    """
+    if context.is_maintenance_node():
+        rollup_indices.delay()
+
+
+@app.task(ignore_result=True)
+def rollup_indices():
+    """
+    Periodic task rolling up the old raw samples into hourly and daily summaries.
+    """
+    es_client = client_pool.get_elasticsearch(ES_HOSTS)
+    Rollup(es_client,
+           lambda: make_bulk_indexer(es_client),
+           lambda indices: prepare_indices(es_client, indices),
+           app.conf.get("PUREELK_ROLLUP_AGE", Rollup.DEFAULT_AGE),
+           app.conf.get("PUREELK_ROLLUP_RAW_TTL", Rollup.DEFAULT_RAW_TTL)).run()
+
+
+def schedule_interval():
+    """
+    The period of the arrays_schedule sweep, in seconds.
+    """
+    return app.conf.CELERYBEAT_SCHEDULE[ARRAYS_SCHEDULE]["schedule"].total_seconds()
+
+
+@app.task(ignore_result=True)
+def array_task_event(array_id, task_id, state):
+    """
+    Runs on the scheduling worker to record the state of a collection task reported by its worker.
+    """
+    context.update_task_state(array_id, task_id, state)
+
+
+@app.task(ignore_result=True)
+def array_fanout_event(array_id, task_id, count):
+    """
+    Runs on the scheduling worker to record the number of volume chunk tasks sent by a collection task.
+    It is sent before the chunks, so it is always received before their completion events.
+    """
+    context.start_chunks(array_id, task_id, count)
+
+
+@app.task(ignore_result=True)
+def array_chunk_event(array_id, task_id, state):
+    """
+    Runs on the scheduling worker to record the completion of a volume chunk task of a collection task.
+    """
+    context.update_chunk_state(array_id, task_id, state)
+
+
+def send_task_event(task_name, args, task_id, state):
+    if task_name == array_collect.name:
+        send_event(array_task_event, [args[0].id, task_id, state], args[0])
+    elif task_name == array_collect_volumes.name and state in ArrayContext.TASK_COMPLETED_STATES:
+        # Chunks are accounted to the collection task that sent them, args[1].
+        send_event(array_chunk_event, [args[0].id, args[1], state], args[0])
+
+
+def send_event(event_task, args, array_context):
+    """
+    Send an event task to the scheduling worker of the node that dispatched the collection.
+    """
+    queue = array_context.scheduler_queue
+    event_task.apply_async(args, **({"queue": queue} if queue else {}))
+
+
+@signals.task_prerun.connect
+def on_task_prerun(sender=None, task_id=None, args=None, **kwargs):
+    send_task_event(sender.name, args, task_id, ArrayContext.TASK_STARTED)
+
+
+@signals.task_success.connect
+def on_task_success(sender=None, **kwargs):
+    send_task_event(sender.name, sender.request.args, sender.request.id, ArrayContext.TASK_SUCCESS)
+
+
+@signals.task_failure.connect
+def on_task_failure(sender=None, task_id=None, args=None, **kwargs):
+    send_task_event(sender.name, args, task_id, ArrayContext.TASK_FAILURE)
+
+
+@signals.task_revoked.connect
+def on_task_revoked(sender=None, request=None, **kwargs):
+    # Also sent for the tasks that expired before a worker could run them.
+    send_task_event(sender.name, request.args, request.id, ArrayContext.TASK_REVOKED)
+
+
+@app.task(ignore_result=True)
+def array_collect(array_context, deadline=None):
     logger.info("Collecting info for array '{}'".format(array_context.name))
 
-    # Create PureStorage client and Elasticsearch client
-    ps_client = purestorage.FlashArray(array_context.host, api_token=array_context.api_token, rest_version="1.4")
-    # "elasticsearch" is the internal link to PureELK ES server
-    es_client = Elasticsearch(hosts="elasticsearch:9200", retry_on_timeout=True)
+    # Scheduling lag is how late the collection started compared to the deadline set by arrays_schedule.
+    metrics = CollectionMetrics(schedule_lag=time.time() - deadline if deadline is not None else None)
+
+    # Get the pooled PureStorage client and Elasticsearch client
+    ps_client = client_pool.get_flasharray(array_context)
+    es_client = client_pool.get_elasticsearch(ES_HOSTS)
+
+    bulk_indexer = make_bulk_indexer(es_client, metrics=metrics, spool=get_spool(es_client))
+
+    # Only the messages newer than the persisted high-water marks are indexed.
+    watermarks = context.store.load_watermarks(array_context.id)
+
+    task_id = array_collect.request.id
+
+    def fanout(chunks, timeofquery, refresh):
+        # The scheduler must know how many chunks to wait for before the collection completes.
+        send_event(array_fanout_event, [array_context.id, task_id, len(chunks)], array_context)
+        for names in chunks:
+            array_collect_volumes.apply_async(
+                [array_context, task_id, names, timeofquery, refresh], expires=TASK_TIMEOUT)
+        logger.info("Sent {} volume chunks of array '{}'".format(len(chunks), array_context.name))
+
+    pure_collector = PureCollector(
+        ps_client, es_client, bulk_indexer, index_cache, array_context, watermarks, metrics, change_cache, fanout,
+        inventory_cache, metadata_cache)
+    state = ArrayContext.TASK_FAILURE
+    try:
+        with time_limit(array_context):
+            pure_collector.collect()
+        state = ArrayContext.TASK_SUCCESS
+    except Exception:
+        # The failure could be caused by an index deleted behind our back, check them all again next time.
+        index_cache.invalidate()
+        change_cache.invalidate(array_context.id)
+        inventory_cache.invalidate(array_context.id)
+        metadata_cache.invalidate(array_context.id)
+        raise
+    finally:
+        send_collection_stats(array_context, metrics, bulk_indexer, state)
+
+    logger.info("Indexed {} documents for array '{}', {} spooled, {} failed".format(
+        bulk_indexer.indexed, array_context.name, bulk_indexer.spooled, bulk_indexer.failed))
+
+    # Keep the old marks if some documents were lost, so the messages are sent again next time.
+    # Likewise all the global documents are written again.
+    if bulk_indexer.failed == 0:
+        context.store.save_watermarks(array_context.id, pure_collector.watermarks)
+    else:
+        change_cache.invalidate(array_context.id)
+
+
+@app.task(ignore_result=True)
+def array_collect_volumes(array_context, parent_task_id, volume_names, timeofquery, refresh=None):
+    """
+    Collect one chunk of the volumes of a large array, sent by its array_collect task.
+    :param parent_task_id: The id of the array_collect task, completed by the last of its chunks.
+    :param volume_names: The names of the volumes of this chunk.
+    :param timeofquery: The time of query shared by all the documents of the collection.
+    :param refresh: The sections refreshed by the collection, the others come from the inventory cache.
+    """
+    logger.info("Collecting {} volumes for array '{}'".format(len(volume_names), array_context.name))
+
+    metrics = CollectionMetrics()
+    ps_client = client_pool.get_flasharray(array_context)
+    es_client = client_pool.get_elasticsearch(ES_HOSTS)
+    bulk_indexer = make_bulk_indexer(es_client, metrics=metrics, spool=get_spool(es_client))
+
+    pure_collector = PureCollector(
+        ps_client, es_client, bulk_indexer, index_cache, array_context, metrics=metrics, change_cache=change_cache,
+        inventory_cache=inventory_cache, metadata_cache=metadata_cache)
+    try:
+        with time_limit(array_context):
+            pure_collector.collect_volumes(volume_names, timeofquery, refresh)
+    except Exception:
+        index_cache.invalidate()
+        change_cache.invalidate(array_context.id)
+        inventory_cache.invalidate(array_context.id)
+        metadata_cache.invalidate(array_context.id)
+        raise
+
+    logger.info("Indexed {} volume documents for array '{}', {} spooled, {} failed".format(
+        bulk_indexer.indexed, array_context.name, bulk_indexer.spooled, bulk_indexer.failed))
+
+    if bulk_indexer.failed > 0:
+        change_cache.invalidate(array_context.id)
+
+
+class TimeLimitExceeded(Exception):
+    pass
+
+
+def time_limit(array_context):
+    """
+    Stop a collection task running longer than the time limit of its array. The exception fails the task
+    like any other error, so the scheduler learns about it from the failure event and can start the next one.
+    """
+    return gevent.Timeout(array_context.collect_time_limit, TimeLimitExceeded(
+        "Collection of array '{}' exceeded its time limit of {} seconds".format(
+            array_context.name, array_context.collect_time_limit)))
+
+
+def send_collection_stats(array_context, metrics, bulk_indexer, state):
+    """
+    Publish the stats of a collection to the web server. Losing them is harmless.
+    """
+    stats = metrics.get_json()
+    stats.update({
+        "array_id": array_context.id,
+        "array_name": array_context.name,
+        "frequency": array_context.frequency,
+        "state": state,
+        "time": time.time(),
+        "indexed": bulk_indexer.indexed,
+        "spooled": bulk_indexer.spooled,
+        "failed": bulk_indexer.failed
+    })
+    try:
+        publish_stats(app, stats)
+    except Exception as e:
+        logger.warn("Error when publishing the stats of array '{}': {}".format(array_context.name, e))
+
+
+def make_bulk_indexer(es_client, metrics=None, spool=None):
+    return BulkIndexer(
+        es_client,
+        chunk_size=app.conf.get("PUREELK_BULK_CHUNK_SIZE", BulkIndexer.DEFAULT_CHUNK_SIZE),
+        max_chunk_bytes=app.conf.get("PUREELK_BULK_MAX_BYTES", BulkIndexer.DEFAULT_MAX_CHUNK_BYTES),
+        max_retries=app.conf.get("PUREELK_BULK_MAX_RETRIES", BulkIndexer.DEFAULT_MAX_RETRIES),
+        metrics=metrics,
+        spool=spool)
+
+
+def prepare_indices(es_client, indices):
+    """
+    Create the indices outside of a collection, unless this process already knows they exist.
+    """
+    date_str = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    index_cache.ensure_indices(es_client, indices, date_str)
+
+
+def get_spool(es_client):
+    """
+    Get the spool of this worker process, creating it and starting its drainer on first use.
+    :return: The spool, None if spooling is disabled.
+    """
+    global spool, spool_drainer
+
+    spool_path = app.conf.get("PUREELK_SPOOL_PATH")
+    if spool is None and spool_path:
+        spool = Spool(spool_path, app.conf.get("PUREELK_SPOOL_MAX_BYTES", Spool.DEFAULT_MAX_BYTES))
 
-    pure_collector = PureCollector(ps_client, es_client, array_context)
-    pure_collector.collect()
+        # Replayed documents may target indices that couldn't be created while ES was down.
+        spool_drainer = SpoolDrainer(
+            spool,
+            lambda replay_spool: make_bulk_indexer(es_client, spool=replay_spool),
+            lambda indices: prepare_indices(es_client, indices),
+            app.conf.get("PUREELK_SPOOL_DRAIN_INTERVAL", SpoolDrainer.DEFAULT_INTERVAL))
+        spool_drainer.start()
+        logger.info("Spooling to {}, {} segments pending".format(spool_path, spool.pending))
 
+    return spool
@@ -0,0 +1,122 @@
+"""
+    Index templates of the pureelk-* indices. Elasticsearch applies them to the indices it
+    creates, so the mappings are installed once instead of with each daily index.
+"""
+
+# Strings used as keys in aggregations and filters.
+KEYWORD = {"type": "string", "index": "not_analyzed"}
+
+# Names that are also searched by word in Kibana, under <field>.analyzed.
+# This replaces the tokenizable *_a copies the documents used to carry.
+KEYWORD_ANALYZED = {
+    "type": "string",
+    "index": "not_analyzed",
+    "fields": {
+        "analyzed": {"type": "string", "index": "analyzed"}
+    }
+}
+
+# The daily indices are written every collection and searched in Kibana by time range.
+# Their documents don't need to be searchable within the second.
+DEFAULT_SHARDS = 1
+DEFAULT_REPLICAS = 0
+DEFAULT_REFRESH_INTERVAL = "30s"
+
+VOL_PROPERTIES = {
+    "name": KEYWORD_ANALYZED,
+    "vol_name": KEYWORD,
+    "array_name": KEYWORD_ANALYZED,
+    "array_id": KEYWORD
+}
+
+ARRAY_PROPERTIES = {
+    "array_name": KEYWORD_ANALYZED,
+    "array_id": KEYWORD,
+    "hostname": KEYWORD,
+    "purity_version": KEYWORD
+}
+
+# (template name, index pattern, doc type, properties, time-series)
+# The host_name and hgroup_name lists of the volume and host group documents stay dynamic, i.e. analyzed.
+TEMPLATES = [
+    ("pureelk-vols", "pureelk-vols-*", "volperf", VOL_PROPERTIES, True),
+    ("pureelk-global-vols", "pureelk-global-vols", "volperf", VOL_PROPERTIES, False),
+    ("pureelk-arrays", "pureelk-arrays-*", "arrayperf", ARRAY_PROPERTIES, True),
+    ("pureelk-global-arrays", "pureelk-global-arrays", "arrayperf", ARRAY_PROPERTIES, False),
+    ("pureelk-hosts", "pureelk-hosts-*", "hostdoc", {
+        "name": KEYWORD,
+        "host_name": KEYWORD_ANALYZED,
+        "array_name": KEYWORD_ANALYZED,
+        "array_id": KEYWORD
+    }, True),
+    ("pureelk-hgroup", "pureelk-hgroup-*", "hgroupdoc", {
+        "name": KEYWORD,
+        "hgroup_name": KEYWORD_ANALYZED,
+        "array_name": KEYWORD_ANALYZED,
+        "array_id": KEYWORD
+    }, True),
+    ("pureelk-msgs", "pureelk-msgs-*", "arraymsg", {
+        "array_name": KEYWORD_ANALYZED,
+        "array_id": KEYWORD,
+        "category": KEYWORD,
+        "current_severity": KEYWORD,
+        "actual": KEYWORD,
+        "component_name": KEYWORD,
+        "component_type": KEYWORD,
+        "details": KEYWORD,
+        "expected": KEYWORD,
+        "event": KEYWORD
+    }, True),
+    ("pureelk-audit", "pureelk-audit-*", "auditmsg", {
+        "array_name": KEYWORD_ANALYZED,
+        "array_id": KEYWORD,
+        "component_name": KEYWORD,
+        "component_type": KEYWORD,
+        "details": KEYWORD,
+        "event": KEYWORD,
+        "user": KEYWORD
+    }, True),
+    ("pureelk-internal", "pureelk-internal-*", "collectorperf", {
+        "array_name": KEYWORD,
+        "array_id": KEYWORD,
+        "failed_sections": KEYWORD,
+        "refreshed_sections": KEYWORD
+    }, True)
+]
+
+
+def index_templates(shards=DEFAULT_SHARDS, replicas=DEFAULT_REPLICAS, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+    """
+    :param shards: Number of shards of each new index.
+    :param replicas: Number of replicas of each new index, 0 on a single node cluster.
+    :param refresh_interval: Refresh interval of the daily indices. The global indices keep the default.
+    :return: list of (template name, template body) tuples.
+    """
+    templates = []
+    for name, pattern, doc_type, properties, time_series in TEMPLATES:
+        settings = {"number_of_shards": shards, "number_of_replicas": replicas}
+        if time_series:
+            settings["refresh_interval"] = refresh_interval
+        templates.append((name, {
+            "template": pattern,
+            "settings": settings,
+            "mappings": {doc_type: {"properties": properties}}
+        }))
+
+    # the rollup documents only have keys and numbers, all their string fields are keys.
+    templates.append(("pureelk-rollup", {
+        "template": "pureelk-rollup-*",
+        "settings": {"number_of_shards": shards, "number_of_replicas": replicas,
+                     "refresh_interval": refresh_interval},
+        "mappings": {
+            "rollup": {
+                "dynamic_templates": [
+                    {"keys": {"match_mapping_type": "string", "mapping": KEYWORD}}
+                ],
+                "properties": {
+                    "timeofquery": {"type": "date"}
+                }
+            }
+        }
+    }))
+    return templates
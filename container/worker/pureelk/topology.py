@@ -0,0 +1,100 @@
+class Topology(object):
+    """
+    Snapshot of the host, host group and volume connections of an array, fetched in bulk
+    once per collection and indexed by name, so the volume, host and host group documents
+    are built without per-object REST calls.
+    """
+
+    def __init__(self, hosts, hgroups, connections):
+        """
+        :param hosts: list of hosts, as returned by list_hosts().
+        :param hgroups: list of host groups, as returned by list_hgroups().
+        :param connections: private and shared connections of all the volumes, as returned by
+                            list_volumes(connect=True). Shared connections have one entry for each
+                            host in the host group.
+        """
+        self._host_hgroup = {}
+        self._hgroup_hosts = {}
+        self._vol_hosts = {}
+        self._vol_hgroups = {}
+        # (volume, host) and (volume, host group) pairs already indexed.
+        seen_hosts = set()
+        seen_hgroups = set()
+
+        for h in hosts:
+            self._host_hgroup[h['name']] = h.get('hgroup')
+        for hg in hgroups:
+            self._hgroup_hosts[hg['name']] = list(hg.get('hosts') or [])
+
+        for c in connections:
+            if c.get('host'):
+                _add(self._vol_hosts, seen_hosts, c['name'], c['host'])
+            if c.get('hgroup'):
+                _add(self._vol_hgroups, seen_hgroups, c['name'], c['hgroup'])
+
+    @classmethod
+    def fetch(cls, ps_client, volume_names=None, page_size=None):
+        """
+        :param volume_names: Only fetch the connections of these volumes, and no hosts and host groups.
+        :param page_size: Max number of volume names selected by each REST call, None for all of them at once.
+        """
+        if volume_names is not None:
+            page_size = page_size or max(1, len(volume_names))
+            connections = []
+            for i in range(0, len(volume_names), page_size):
+                connections += ps_client.list_volumes(connect=True, names=','.join(volume_names[i:i + page_size]))
+            return cls([], [], connections)
+        return cls(ps_client.list_hosts(), ps_client.list_hgroups(), ps_client.list_volumes(connect=True))
+
+    @classmethod
+    def from_volumes(cls, volume_connections):
+        """
+        Snapshot of the connections of some volumes only, and no hosts and host groups.
+        :param volume_connections: dict of volume name -> (hosts, host groups), as returned by volume_connections().
+        """
+        connections = []
+        for name, (hosts, hgroups) in volume_connections.items():
+            connections += [{'name': name, 'host': h} for h in hosts]
+            connections += [{'name': name, 'hgroup': hg} for hg in hgroups]
+        return cls([], [], connections)
+
+    def volume_connections(self, volume):
+        """
+        :return: (hosts, host groups) connected to the volume.
+        """
+        return self.volume_hosts(volume), self.volume_hgroups(volume)
+
+    @property
+    def hosts(self):
+        return list(self._host_hgroup)
+
+    @property
+    def hgroups(self):
+        return list(self._hgroup_hosts)
+
+    def host_hgroup(self, host):
+        return self._host_hgroup.get(host)
+
+    def hgroup_hosts(self, hgroup):
+        return self._hgroup_hosts.get(hgroup, [])
+
+    def volume_hosts(self, volume):
+        return self._vol_hosts.get(volume, [])
+
+    def volume_hgroups(self, volume):
+        return self._vol_hgroups.get(volume, [])
+
+
+def names_string(names):
+    """
+    Space separated names, a large string that we are hoping elasticsearch will tokenize and help us match.
+    """
+    return ''.join(n + ' ' for n in names)
+
+
+def _add(index, seen, key, value):
+    # Keep the first-seen order, without the repeats of a volume shared with every host of a group.
+    # The seen set makes each check constant time, however many connections a volume has.
+    if (key, value) not in seen:
+        seen.add((key, value))
+        index.setdefault(key, []).append(value)
@@ -6,6 +6,7 @@ from celery.bin import Option
 from celery.utils.log import get_task_logger
 
 from .context import Context
+from .membership import Membership, scheduler_queue
 
 
 '''
@@ -13,6 +14,7 @@ from .context import Context
 '''
 
 ARRAY_CONFIGS = "array_configs"
+NODE_ID = "node_id"
 
 # logger for the worker tasks.
 logger = get_task_logger(__name__)
@@ -28,10 +30,29 @@ app.user_options['preload'].add(Option(
     help='Path to array configs',
 ))
 
+app.user_options['preload'].add(Option(
+    '--node-id', default='',
+    help='Id of this worker node, when several nodes share the array configs',
+))
+
 @signals.user_preload_options.connect
 def handle_preload_options(options, **kwargs):
     global context
-    context = Context(options[ARRAY_CONFIGS])
+    node_id = options.get(NODE_ID) or None
+    if node_id:
+        # The periodic tasks and the task events of each node go to its own scheduling worker.
+        queue = scheduler_queue(node_id)
+        app.conf.update(CELERY_DEFAULT_QUEUE=queue, CELERY_DEFAULT_EXCHANGE=queue, CELERY_DEFAULT_ROUTING_KEY=queue)
+
+    context = Context(options[ARRAY_CONFIGS], node_id,
+                      app.conf.get("PUREELK_NODE_TIMEOUT", Membership.DEFAULT_TIMEOUT))
+
+
+@signals.worker_shutdown.connect
+def handle_worker_shutdown(**kwargs):
+    # Leave right away instead of once the heartbeat times out.
+    if context is not None:
+        context.leave()
 
 
 
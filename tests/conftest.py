@@ -0,0 +1,29 @@
+"""
+    Unit tests of the PureELK worker.
+
+    Usage:
+        python -m pytest tests
+
+    The collection tests run against the fake FlashArray and Elasticsearch endpoint of the benchmark.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "container", "worker"))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "benchmark"))
+
+from pureelk import worker
+from pureelk.context import Context
+
+# The worker normally gets its context from the --array-configs command line option, and its broker from
+# workerconfig. pureelk.tasks reads the context when it is first imported.
+CONFIG_DIR = tempfile.mkdtemp(prefix="pureelk-test-")
+worker.app.conf.update(BROKER_URL="memory://")
+worker.context = Context(CONFIG_DIR)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(CONFIG_DIR, ignore_errors=True)
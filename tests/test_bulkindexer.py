@@ -0,0 +1,79 @@
+import json
+
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+from pureelk.bulkindexer import BulkIndexer, is_retryable
+
+
+class Client(object):
+    """
+    Elasticsearch client recording the _bulk requests, rejecting the given sources the first times they are sent.
+    """
+
+    def __init__(self, rejected=None):
+        self.rejected = dict(rejected or {})
+        self.requests = []
+
+    def bulk(self, body):
+        sources = body.splitlines()[1::2]
+        self.requests.append(sources)
+
+        items = []
+        for source in sources:
+            status = 201
+            if self.rejected.get(source):
+                self.rejected[source] -= 1
+                status = 429
+            items.append({"index": {"status": status}})
+        return {"errors": any(item["index"]["status"] != 201 for item in items), "items": items}
+
+
+def source(n):
+    return json.dumps({"n": n})
+
+
+def test_batches():
+    client = Client()
+    indexer = BulkIndexer(client, chunk_size=10)
+    for n in range(25):
+        indexer.index("pureelk-vols", "volperf", {"n": n})
+    indexer.flush()
+
+    assert [len(sources) for sources in client.requests] == [10, 10, 5]
+    assert indexer.indexed == 25
+
+
+def test_batches_by_bytes():
+    client = Client()
+    # Room for two documents per batch, each one sent as its action and source lines.
+    action = json.dumps({"index": {"_index": "pureelk-vols", "_type": "volperf"}})
+    indexer = BulkIndexer(client, max_chunk_bytes=2 * (len(action) + len(source(0)) + 2))
+    for n in range(5):
+        indexer.index("pureelk-vols", "volperf", source(n))
+    indexer.flush()
+
+    assert [len(sources) for sources in client.requests] == [2, 2, 1]
+
+
+def test_rejected_items_retried():
+    client = Client(rejected={source(1): 2, source(2): 10})
+    indexer = BulkIndexer(client, max_retries=3, retry_backoff=0)
+    for n in range(3):
+        indexer.index("pureelk-vols", "volperf", source(n))
+    indexer.flush()
+
+    # Only the rejected documents are sent again, until they run out of retries.
+    assert client.requests == [[source(0), source(1), source(2)], [source(1), source(2)], [source(1), source(2)],
+                               [source(2)]]
+    assert indexer.indexed == 2
+    assert indexer.failed == 1
+
+
+def test_is_retryable():
+    assert is_retryable(ConnectionError("N/A", "connection refused", None))
+    assert is_retryable(ConnectionTimeout("TIMEOUT", "read timed out", None))
+    assert is_retryable(TransportError(429, "es_rejected_execution_exception"))
+    assert is_retryable(TransportError(503, "unavailable_shards_exception"))
+
+    assert not is_retryable(TransportError(400, "mapper_parsing_exception"))
+    assert not is_retryable(TransportError(404, "index_not_found_exception"))
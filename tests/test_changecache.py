@@ -0,0 +1,36 @@
+from pureelk import changecache
+from pureelk.changecache import ChangeCache
+
+
+def make_volume(**fields):
+    volume = {"name": "vol-00000", "serial": "0001ABCD", "host_name": "host-0000 ", "size": 1 << 40,
+              "timeofquery": "2016-06-30T00:00:00", "reads_per_sec": 100, "total": 1 << 30, "volumes": 1 << 30,
+              "snapshots": 0, "data_reduction": 4.2, "thin_provisioning": 0.8, "total_reduction": 21.0}
+    volume.update(fields)
+    return volume
+
+
+def test_space_change_not_written():
+    cache = ChangeCache()
+    assert cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume())
+
+    # Another cycle, only the samples and the space usage changed.
+    assert not cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume(
+        timeofquery="2016-06-30T00:01:00", reads_per_sec=200, total=2 << 30, volumes=2 << 30, snapshots=1 << 20,
+        data_reduction=3.9, thin_provisioning=0.7, total_reduction=18.5))
+
+
+def test_descriptive_change_written():
+    cache = ChangeCache()
+    cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume())
+    assert cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume(host_name="host-0001 "))
+
+
+def test_unchanged_rewritten_after_refresh_interval(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(changecache.time, "time", lambda: now[0])
+    cache = ChangeCache(refresh_interval=60)
+    cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume())
+
+    now[0] += 60
+    assert cache.should_write("array-1", "pureelk-global-vols", "0001ABCD", make_volume())
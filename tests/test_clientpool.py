@@ -0,0 +1,64 @@
+import pytest
+
+from pureelk import clientpool
+from pureelk.arraycontext import ArrayContext
+from pureelk.clientpool import ClientPool
+
+
+class FlashArray(object):
+    def __init__(self, host, api_token, rest_version):
+        self.host = host
+        self.api_token = api_token
+        self.closed = False
+
+    def invalidate_cookie(self):
+        self.closed = True
+
+
+def make_array_context(array_id):
+    array = ArrayContext()
+    array.update_config_json({
+        ArrayContext.ID: array_id,
+        ArrayContext.NAME: array_id,
+        ArrayContext.HOST: "{}.example.com".format(array_id),
+        ArrayContext.API_TOKEN: "token"
+    })
+    return array
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(clientpool.purestorage, "FlashArray", FlashArray)
+    monkeypatch.setattr(clientpool.time, "time", lambda: now[0])
+    return now
+
+
+def test_session_reused(now):
+    pool = ClientPool(idle_timeout=60)
+    array = make_array_context("array-1")
+    client = pool.get_flasharray(array)
+    now[0] += 50
+    assert pool.get_flasharray(array) is client
+    now[0] += 50
+    assert pool.get_flasharray(array) is client
+    assert not client.closed
+
+
+def test_config_changed(now):
+    pool = ClientPool()
+    array = make_array_context("array-1")
+    client = pool.get_flasharray(array)
+
+    array.update_config_json(dict(array.get_config_json(), **{array.API_TOKEN: "new token"}))
+    new_client = pool.get_flasharray(array)
+    assert client.closed
+    assert new_client.api_token == "new token"
+
+
+def test_idle_session_closed(now):
+    pool = ClientPool(idle_timeout=60)
+    removed = pool.get_flasharray(make_array_context("array-1"))
+    now[0] += 60
+    pool.get_flasharray(make_array_context("array-2"))
+    assert removed.closed
@@ -0,0 +1,83 @@
+import pytest
+
+from pureelk import indexcache
+from pureelk.indexcache import IndexCache
+
+TEMPLATES = [("pureelk-vols", {"template": "pureelk-vols-*"}), ("pureelk-global", {"template": "pureelk-global-*"})]
+
+
+class Indices(object):
+    """
+    Elasticsearch indices API recording the templates installed and the indices created.
+    """
+
+    def __init__(self):
+        self.existing = set()
+        self.created = []
+        self.templates = []
+        self.exists_checks = 0
+
+    def put_template(self, name, body):
+        self.templates.append(name)
+
+    def create(self, index, ignore=None):
+        self.existing.add(index)
+        self.created.append(index)
+
+    def exists(self, index):
+        self.exists_checks += 1
+        return all(i in self.existing for i in index.split(","))
+
+
+class Client(object):
+    def __init__(self):
+        self.indices = Indices()
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(indexcache.time, "time", lambda: now[0])
+    return now
+
+
+def test_rollover(now):
+    client = Client()
+    cache = IndexCache(templates=TEMPLATES)
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30", "pureelk-global-vols"], "2016-06-30")
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30", "pureelk-global-vols"], "2016-06-30")
+    assert client.indices.created == ["pureelk-vols-keep-2016-06-30", "pureelk-global-vols"]
+
+    # The indices of the new day are created, the others are checked again.
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-07-01", "pureelk-global-vols"], "2016-07-01")
+    assert client.indices.created[2:] == ["pureelk-vols-keep-2016-07-01", "pureelk-global-vols"]
+
+
+def test_revalidate(now):
+    client = Client()
+    cache = IndexCache(revalidate_interval=300, templates=TEMPLATES)
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30"], "2016-06-30")
+
+    now[0] += 299
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30"], "2016-06-30")
+    assert client.indices.exists_checks == 0
+
+    # Deleted outside of the worker, noticed once the interval is over.
+    client.indices.existing.clear()
+    now[0] += 1
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30"], "2016-06-30")
+    assert client.indices.exists_checks == 1
+    assert client.indices.created == ["pureelk-vols-keep-2016-06-30"] * 2
+    # The templates may have been lost with the index.
+    assert client.indices.templates == ["pureelk-vols", "pureelk-global"] * 2
+
+
+def test_templates_installed_once(now):
+    client = Client()
+    cache = IndexCache(templates=TEMPLATES)
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-06-30", "pureelk-vols-7d-2016-06-30"], "2016-06-30")
+    cache.ensure_indices(client, ["pureelk-vols-90d-2016-06-30", "pureelk-global-vols"], "2016-06-30")
+    cache.ensure_indices(client, ["pureelk-vols-keep-2016-07-01"], "2016-07-01")
+
+    assert len(client.indices.created) == 5
+    assert client.indices.templates == ["pureelk-vols", "pureelk-global"]
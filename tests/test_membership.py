@@ -0,0 +1,168 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from pureelk import membership
+from pureelk.membership import Membership, NODES_DIR
+from pureelk.ring import HashRing
+
+logger = logging.getLogger(__name__)
+
+
+class Array(object):
+    def __init__(self, array_id):
+        self.id = array_id
+        self.is_task_completed = True
+
+
+class Clock(object):
+    """
+    time.time() of the membership module, advanced by hand. Each node can have its own offset.
+    """
+
+    def __init__(self):
+        self.now = 1000000.0
+        self.offset = 0
+
+    def time(self):
+        return self.now + self.offset
+
+
+@pytest.fixture
+def path():
+    path = tempfile.mkdtemp(prefix="pureelk-test-")
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(membership.time, "time", clock.time)
+    return clock
+
+
+ARRAYS = [Array("array-{}".format(i)) for i in range(30)]
+
+
+def sweep(nodes, clock, offsets=None):
+    clock.now += 10
+    owned = {}
+    for node in nodes:
+        clock.offset = (offsets or {}).get(node.node_id, 0)
+        owned[node.node_id] = node.assign(ARRAYS)
+    clock.offset = 0
+    return owned
+
+
+def assert_single_owners(owned):
+    all_owned = [a for ids in owned.values() for a in ids]
+    assert len(all_owned) == len(set(all_owned))
+
+
+def assign_unseen(node, path):
+    """
+    Assign the arrays of a node with the heartbeats of the other nodes hidden, as if they were all written at once.
+    """
+    nodes_dir = os.path.join(path, NODES_DIR)
+    hidden_dir = os.path.join(path, "hidden")
+    shutil.copytree(nodes_dir, hidden_dir) if os.path.isdir(nodes_dir) else os.mkdir(hidden_dir)
+    shutil.rmtree(nodes_dir, ignore_errors=True)
+    owned = node.assign(ARRAYS)
+    for name in os.listdir(hidden_dir):
+        shutil.copy(os.path.join(hidden_dir, name), nodes_dir)
+    shutil.rmtree(hidden_dir)
+    return owned
+
+
+def test_nodes_starting_together(path, clock):
+    nodes = [Membership(path, "node-{}".format(i), logger) for i in range(3)]
+
+    # The claims are only announced by the first sweep.
+    clock.now += 10
+    assert not any(assign_unseen(node, path) for node in nodes)
+
+    for _ in range(3):
+        owned = sweep(nodes, clock)
+        assert_single_owners(owned)
+    assert sum(len(ids) for ids in owned.values()) == len(ARRAYS)
+    assert all(owned.values())
+
+
+def test_clock_skew(path, clock):
+    nodes = [Membership(path, "node-{}".format(i), logger) for i in range(3)]
+    offsets = {"node-0": -3600, "node-2": 3600}
+
+    for _ in range(3):
+        owned = sweep(nodes, clock, offsets)
+        assert_single_owners(owned)
+    # The nodes see each other alive, whatever their clocks.
+    assert all(owned.values())
+    assert sum(len(ids) for ids in owned.values()) == len(ARRAYS)
+
+
+def test_node_leaving_and_joining(path, clock):
+    nodes = [Membership(path, "node-{}".format(i), logger) for i in range(3)]
+    sweep(nodes, clock)
+    before = sweep(nodes, clock)
+
+    nodes[2].leave()
+    sweep(nodes[:2], clock)
+    owned = sweep(nodes[:2], clock)
+    assert_single_owners(owned)
+    assert sum(len(ids) for ids in owned.values()) == len(ARRAYS)
+    # Only the arrays of the node that left moved.
+    for node_id in ("node-0", "node-1"):
+        assert before[node_id] <= owned[node_id]
+
+
+def test_dead_node(path, clock):
+    nodes = [Membership(path, "node-{}".format(i), logger, timeout=30) for i in range(2)]
+    sweep(nodes, clock)
+    sweep(nodes, clock)
+
+    # node-1 stops sending its heartbeat, node-0 takes over once it timed out.
+    owned = {}
+    for _ in range(5):
+        owned = sweep(nodes[:1], clock)
+    assert owned["node-0"] == set(a.id for a in ARRAYS)
+
+
+def test_collection_in_flight(path, clock):
+    nodes = [Membership(path, "node-{}".format(i), logger) for i in range(2)]
+    sweep(nodes, clock)
+    sweep(nodes, clock)
+
+    # node-2 joins while node-0 still runs the collection of an array moving to node-2.
+    ring = HashRing(["node-0", "node-1", "node-2"])
+    busy = [a for a in ARRAYS if a.id in nodes[0].claimed and ring.owner(a.id) == "node-2"][0]
+    busy.is_task_completed = False
+    nodes.append(Membership(path, "node-2", logger))
+    sweep(nodes, clock)
+    try:
+        for _ in range(3):
+            owned = sweep(nodes, clock)
+            assert_single_owners(owned)
+            assert busy.id in nodes[0].claimed
+            assert busy.id not in owned["node-0"] | owned["node-2"]
+
+        busy.is_task_completed = True
+        sweep(nodes, clock)
+        owned = sweep(nodes, clock)
+        assert busy.id not in nodes[0].claimed
+        assert busy.id in owned["node-2"]
+        assert sum(len(ids) for ids in owned.values()) == len(ARRAYS)
+    finally:
+        busy.is_task_completed = True
+
+
+def test_heartbeats_outside_of_config_folder(path, clock):
+    node = Membership(path, "node-0", logger)
+    sweep([node], clock)
+    # The mtime of the config folder tells the store whether configs were added or removed.
+    os.utime(path, (0, 0))
+    sweep([node], clock)
+    assert os.stat(path).st_mtime == 0
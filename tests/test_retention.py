@@ -0,0 +1,71 @@
+import datetime
+
+from pureelk.retention import NO_RETENTION, RetentionSweeper, ttl_group, ttl_seconds
+
+
+class Indices(object):
+    def __init__(self, names):
+        self.names = names
+        self.deleted = []
+
+    def get_settings(self, index):
+        return dict((name, {}) for name in self.names)
+
+    def delete(self, index, ignore=None):
+        self.deleted += index.split(",")
+
+
+class Client(object):
+    def __init__(self, names):
+        self.indices = Indices(names)
+
+
+NOW = datetime.datetime(2016, 6, 30, 12)
+
+
+def test_ttl_group():
+    assert ttl_group("90d") == "90d"
+    assert ttl_group(" 12H ") == "12h"
+    assert ttl_group(None) == NO_RETENTION
+    # Invalid TTLs keep the data rather than deleting it too early.
+    assert ttl_group("90 days") == NO_RETENTION
+    assert ttl_group(90) == NO_RETENTION
+
+    assert ttl_seconds("90d") == 90 * 86400
+    assert ttl_seconds("2w") == 14 * 86400
+    assert ttl_seconds(NO_RETENTION) is None
+
+
+def test_sweep_indices():
+    client = Client([
+        "pureelk-vols-7d-2016-06-20",
+        "pureelk-vols-7d-2016-06-29",
+        "pureelk-arrays-keep-2016-01-01",
+        "pureelk-global-vols",
+    ])
+    RetentionSweeper(client).sweep_indices(NOW)
+    assert client.indices.deleted == ["pureelk-vols-7d-2016-06-20"]
+
+
+def test_rollups_outlive_raw_indices():
+    client = Client([
+        "pureelk-vols-7d-2016-06-20",
+        "pureelk-rollup-hourly-vols-7d-2016-06-20",
+        "pureelk-rollup-daily-vols-7d-2016-06-20",
+        "pureelk-rollup-daily-vols-7d-2016-05-01",
+        "pureelk-rollup-daily-vols-90d-2016-03-01",
+        "pureelk-rollup-daily-vols-keep-2015-01-01",
+    ])
+    RetentionSweeper(client, rollup_ttl=30 * 86400).sweep_indices(NOW)
+    # The rollups are kept for the rollup TTL, or the TTL of their group if longer.
+    assert sorted(client.indices.deleted) == [
+        "pureelk-rollup-daily-vols-7d-2016-05-01",
+        "pureelk-rollup-daily-vols-90d-2016-03-01",
+        "pureelk-vols-7d-2016-06-20",
+    ]
+
+
+def test_rollups_kept_without_ttl():
+    client = Client(["pureelk-rollup-daily-vols-7d-2010-01-01"])
+    RetentionSweeper(client, rollup_ttl=None).sweep_indices(NOW)
+    assert client.indices.deleted == []
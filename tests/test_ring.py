@@ -0,0 +1,37 @@
+from pureelk.ring import HashRing
+
+KEYS = ["array-{}".format(i) for i in range(1000)]
+
+
+def owners(ring):
+    return dict((key, ring.owner(key)) for key in KEYS)
+
+
+def test_assignment_stable():
+    nodes = ["node-0", "node-1", "node-2"]
+    # Same owners whatever the order of the nodes, or the ring instance.
+    assert owners(HashRing(nodes)) == owners(HashRing(list(reversed(nodes))))
+
+    counts = {}
+    for owner in owners(HashRing(nodes)).values():
+        counts[owner] = counts.get(owner, 0) + 1
+    assert sorted(counts) == nodes
+    assert min(counts.values()) > len(KEYS) / len(nodes) / 2
+
+
+def test_node_joining_and_leaving():
+    before = owners(HashRing(["node-0", "node-1", "node-2"]))
+    after = owners(HashRing(["node-0", "node-1", "node-2", "node-3"]))
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Only the keys taken by the new node move, about a quarter of them.
+    assert all(after[key] == "node-3" for key in moved)
+    assert len(moved) < len(KEYS) / 2
+
+    # Leaving gives them back to their previous owners.
+    assert owners(HashRing(["node-0", "node-1", "node-2"])) == before
+
+
+def test_empty_ring():
+    assert HashRing([]).owner("array-0") is None
+    assert HashRing([]).nodes == []
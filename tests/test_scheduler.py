@@ -0,0 +1,40 @@
+from pureelk.scheduler import DeadlineScheduler
+
+
+def test_pop_due():
+    scheduler = DeadlineScheduler()
+    scheduler.push("array-1", 120, 60)
+    scheduler.push("array-2", 100, 60)
+    scheduler.push("array-3", 200, 60)
+
+    assert scheduler.pop_due(99) == []
+    # Earliest first, up to and including the given time.
+    assert scheduler.pop_due(120) == [("array-2", 100), ("array-1", 120)]
+    assert scheduler.frequency("array-1") is None
+    assert scheduler.frequency("array-3") == 60
+    assert scheduler.pop_due(300) == [("array-3", 200)]
+
+
+def test_pop_due_stale_entries():
+    scheduler = DeadlineScheduler()
+    scheduler.push("array-1", 100, 60)
+    scheduler.push("array-2", 100, 60)
+    # Rescheduled later and removed, the entries left in the heap are skipped.
+    scheduler.push("array-1", 150, 30)
+    scheduler.remove("array-2")
+
+    assert scheduler.pop_due(120) == []
+    assert scheduler.pop_due(150) == [("array-1", 150)]
+
+
+def test_next_deadline():
+    for array_id in ["array-{}".format(i) for i in range(20)]:
+        phase = DeadlineScheduler.phase(array_id, 60)
+        assert 0 <= phase < 60
+
+        deadline = DeadlineScheduler.next_deadline(array_id, 60, 1000)
+        assert 1000 <= deadline < 1060
+        slots = (deadline - phase) / 60
+        assert abs(slots - round(slots)) < 1e-6
+        # A deadline is its own next slot.
+        assert DeadlineScheduler.next_deadline(array_id, 60, deadline) == deadline
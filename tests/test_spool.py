@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+from elasticsearch.exceptions import ConnectionError
+
+from pureelk.bulkindexer import BulkIndexer
+from pureelk.spool import Spool, SpoolDrainer
+
+
+class Client(object):
+    """
+    Elasticsearch client indexing the _bulk requests, unreachable after the given number of them.
+    """
+
+    def __init__(self, up_for=None):
+        self.up_for = up_for
+        self.sources = []
+
+    def bulk(self, body):
+        if self.up_for is not None:
+            if self.up_for == 0:
+                raise ConnectionError("N/A", "unreachable", None)
+            self.up_for -= 1
+        lines = body.splitlines()
+        self.sources += lines[1::2]
+        return {"errors": False, "items": [{"index": {"status": 201}} for _ in lines[1::2]]}
+
+
+@pytest.fixture
+def path():
+    path = tempfile.mkdtemp(prefix="pureelk-test-")
+    yield path
+    shutil.rmtree(path)
+
+
+def make_actions(start, count):
+    return [(json.dumps({"index": {"_index": "pureelk-vols-keep-2016-06-30", "_type": "volperf"}}),
+             json.dumps({"n": n})) for n in range(start, start + count)]
+
+
+def make_drainer(spool, client):
+    return SpoolDrainer(spool, lambda replay_spool: BulkIndexer(client, chunk_size=10, max_retries=0,
+                                                                retry_backoff=0, spool=replay_spool))
+
+
+def test_partial_replay(path):
+    spool = Spool(path)
+    spool.append(make_actions(0, 30))
+    spool.append(make_actions(30, 10))
+
+    # Down again after the first chunk of the oldest segment.
+    client = Client(up_for=1)
+    assert not make_drainer(spool, client).drain()
+    assert spool.pending == 2
+
+    client.up_for = None
+    drainer = make_drainer(spool, client)
+    while drainer.drain():
+        pass
+
+    # Each document indexed once, in order.
+    assert client.sources == [json.dumps({"n": n}) for n in range(40)]
+    assert spool.pending == 0
+    assert os.listdir(path) == []
+
+
+def test_segments_claimed_once(path):
+    Spool(path).append(make_actions(0, 10))
+    spools = [Spool(path), Spool(path)]
+
+    claimed = spools[0].claim()
+    assert claimed is not None
+    assert spools[1].claim() is None
+
+    spools[0].release(claimed[0], claimed[1][5:])
+    name, actions = spools[1].claim()
+    assert actions == make_actions(5, 5)
+
+
+def test_expired_claim(path):
+    spool = Spool(path)
+    spool.append(make_actions(0, 10))
+    name, _ = spool.claim()
+
+    # The process replaying the segment died.
+    os.utime(os.path.join(path, name), (0, 0))
+    name, actions = Spool(path).claim()
+    assert actions == make_actions(0, 10)
@@ -0,0 +1,64 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from pureelk.arraycontext import ArrayContext
+from pureelk.store import Store
+
+logger = logging.getLogger(__name__)
+
+
+def make_array_context(array_id):
+    array = ArrayContext()
+    array.update_config_json({
+        ArrayContext.ID: array_id,
+        ArrayContext.NAME: array_id,
+        ArrayContext.HOST: "{}.example.com".format(array_id),
+        ArrayContext.API_TOKEN: "token"
+    })
+    return array
+
+
+@pytest.fixture
+def path():
+    path = tempfile.mkdtemp(prefix="pureelk-test-")
+    yield path
+    shutil.rmtree(path)
+
+
+def test_watermarks(path):
+    store = Store(path, logger)
+    assert store.load_watermarks("array-1") == {}
+
+    watermarks = {"messages": 1234, "audit": 5678}
+    store.save_watermarks("array-1", watermarks)
+    assert store.load_watermarks("array-1") == watermarks
+    # Read back by another process too.
+    assert Store(path, logger).load_watermarks("array-1") == watermarks
+    assert store.load_watermarks("array-2") == {}
+
+
+def test_watermarks_removed_with_array(path):
+    store = Store(path, logger)
+    array = make_array_context("array-1")
+    store.save_array_config(array)
+    store.save_watermarks(array.id, {"messages": 1234})
+    assert list(store.load_arrays()) == [array.id]
+
+    store.remove_array_config(array.id)
+    assert store.load_arrays() == {}
+    assert store.load_watermarks(array.id) == {}
+    assert os.listdir(path) == []
+
+
+def test_corrupt_watermarks(path):
+    store = Store(path, logger)
+    store.save_watermarks("array-1", {"messages": 1234})
+    with open(os.path.join(path, ".pureelk.array-1.watermarks"), "w") as watermarks_file:
+        watermarks_file.write("{")
+
+    # The messages are indexed again rather than the collection failing.
+    assert store.load_watermarks("array-1") == {}
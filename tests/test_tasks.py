@@ -0,0 +1,101 @@
+import threading
+import time
+
+import gevent
+import pytest
+
+from fakearray import FakeFlashArray
+from fakees import FakeElasticsearchHandler, ThreadingHTTPServer
+from pureelk import tasks
+from pureelk.arraycontext import ArrayContext
+
+
+@pytest.fixture
+def es_hosts():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeElasticsearchHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    FakeElasticsearchHandler.stats.reset()
+    yield "127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def make_array_context(array_id):
+    array = ArrayContext()
+    array.update_config_json({
+        ArrayContext.ID: "fake-" + array_id,
+        ArrayContext.NAME: "fake-" + array_id,
+        ArrayContext.HOST: "fake-{}.example.com".format(array_id),
+        ArrayContext.API_TOKEN: "token"
+    })
+    return array
+
+
+def test_array_collect(es_hosts, monkeypatch):
+    array = make_array_context("0001")
+    fake_array = FakeFlashArray("0001", num_volumes=20, num_hosts=4, num_hgroups=2, num_messages=5)
+    monkeypatch.setattr(tasks, "ES_HOSTS", es_hosts)
+    monkeypatch.setattr(tasks.client_pool, "get_flasharray", lambda array_context: fake_array)
+
+    tasks.array_collect(array, deadline=time.time())
+
+    stats = FakeElasticsearchHandler.stats.get_json()
+    assert fake_array.call_count > 0
+    assert stats["bulk_requests"] > 0
+    # At least a volume document each, and the messages.
+    assert stats["documents"] >= 20 + 5
+    # The messages are not indexed again by the next collection.
+    assert tasks.context.store.load_watermarks(array.id)
+
+
+def test_chunk_pages_volume_names(es_hosts, monkeypatch):
+    array = make_array_context("0004")
+    array.update_config_json(dict(array.get_config_json(), **{ArrayContext.VOLUME_PAGE_SIZE: 10}))
+    fake_array = FakeFlashArray("0004", num_volumes=50, num_hosts=4, num_hgroups=2, num_messages=0)
+    names = []
+    list_volumes = fake_array.list_volumes
+
+    def record_names(**kwargs):
+        names.append(kwargs.get("names", "").split(","))
+        return list_volumes(**kwargs)
+
+    monkeypatch.setattr(fake_array, "list_volumes", record_names)
+    monkeypatch.setattr(tasks, "ES_HOSTS", es_hosts)
+    monkeypatch.setattr(tasks.client_pool, "get_flasharray", lambda array_context: fake_array)
+
+    chunk = ["vol-{:05d}".format(i) for i in range(25)]
+    tasks.array_collect_volumes(array, "task", chunk, "2016-06-30T00:00:00", list(ArrayContext.SECTIONS))
+
+    # The inventory, connections, space and perf of the chunk, without any URL longer than a page of names.
+    assert max(len(page) for page in names) == 10
+    assert FakeElasticsearchHandler.stats.get_json()["documents"] >= 25
+
+
+def test_time_limit():
+    array = make_array_context("0002")
+    array.update_config_json(dict(array.get_config_json(), **{ArrayContext.COLLECT_TIME_LIMIT: 1}))
+
+    with pytest.raises(tasks.TimeLimitExceeded):
+        with tasks.time_limit(array):
+            gevent.sleep(2)
+
+
+@pytest.mark.parametrize("fanout_volumes", [None, 1000])
+def test_running_task_is_not_lost(fanout_volumes):
+    array = make_array_context("0003")
+    array.update_config_json(dict(array.get_config_json(), **{ArrayContext.FANOUT_VOLUMES: fanout_volumes}))
+    array.task_id = "task"
+    array.task_state = ArrayContext.TASK_STARTED
+
+    # Started as late as it could, and still running up to its time limit.
+    longest = ArrayContext.TASK_START_TIMEOUT + array.collect_time_limit
+    if fanout_volumes:
+        # The last chunk task too.
+        longest *= 2
+    array.task_starttime = time.time() - longest
+    assert not array.is_task_completed
+
+    array.task_starttime = time.time() - array.task_lost_timeout - 1
+    assert array.is_task_completed